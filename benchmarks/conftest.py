@@ -0,0 +1,61 @@
+# Copyright (C) 2018 VIB/BEG/UGent - Tim Diels <timdiels.m@gmail.com>
+#
+# This file is part of MORPH.
+#
+# MORPH is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MORPH is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with MORPH.  If not, see <http://www.gnu.org/licenses/>.
+
+import tracemalloc
+
+import pytest
+
+from morphbio.tests.synthetic import generate
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        '--genes', default='1000,10000',
+        help='Comma separated numbers of genes of the synthetic expression matrices to benchmark with.'
+    )
+
+def pytest_generate_tests(metafunc):
+    if 'genes' in metafunc.fixturenames:
+        genes = [int(count) for count in metafunc.config.getoption('genes').split(',')]
+        metafunc.parametrize('genes', genes, scope='session')
+
+@pytest.fixture(scope='session')
+def config(genes, tmpdir_factory):
+    '''
+    Synthetic config of given size, see morphbio.tests.synthetic.generate.
+    '''
+    return generate(tmpdir_factory.mktemp('synthetic_{}'.format(genes)), genes)
+
+@pytest.fixture
+def measure(benchmark):
+    '''
+    Benchmark a function and record its peak memory use.
+
+    Peak memory is measured in a separate, untimed call with tracemalloc, which
+    also traces numpy allocations, and is stored in the benchmark's extra_info
+    as ``peak_memory`` in bytes.
+    '''
+    def measure(func, *args, **kwargs):
+        tracemalloc.start()
+        try:
+            func(*args, **kwargs)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        benchmark.extra_info['peak_memory'] = peak
+        return benchmark(func, *args, **kwargs)
+    return measure
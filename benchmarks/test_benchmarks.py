@@ -0,0 +1,94 @@
+# Copyright (C) 2018 VIB/BEG/UGent - Tim Diels <timdiels.m@gmail.com>
+#
+# This file is part of MORPH.
+#
+# MORPH is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MORPH is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with MORPH.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Benchmarks of MORPH as a whole and of its stages
+
+Run with ``pytest benchmarks``, see the developer documentation.
+'''
+
+from varbio import clean, parse
+import numpy as np
+import pytest
+
+from morphbio.algorithm import (
+    morph, _ClusteringRegistry, _ClusteringStack, _GeneTable,
+    _StackRanking, _StandardisedMatrix, _get_correlation_dtype,
+    _parse_clustering, _standardise
+)
+
+
+@pytest.fixture(scope='session')
+def matrix_info(config):
+    return config['species']['synthetic']['expression_matrices']['matrix']
+
+@pytest.fixture(scope='session')
+def gene_table():
+    return _GeneTable()
+
+@pytest.fixture(scope='session')
+def matrix(matrix_info, config, gene_table):
+    with open(matrix_info['path']) as f:
+        matrix = parse.expression_matrix(clean.plain_text(f))
+    return _StandardisedMatrix(
+        gene_table.intern(matrix.index),
+        _standardise(matrix.values, _get_correlation_dtype(config))
+    )
+
+@pytest.fixture(scope='session')
+def clustering(matrix_info, gene_table):
+    return _ClusteringRegistry(None, gene_table).get(matrix_info['clusterings']['clustering0'])
+
+@pytest.fixture(scope='session')
+def baits(config, matrix, clustering, gene_table):
+    group = config['bait_groups']['synthetic']['group0']
+    baits = gene_table.intern(sorted(group['genes']))
+    return baits[(matrix.get_rows(baits) != -1) & clustering.contains(baits)]
+
+@pytest.fixture(scope='session')
+def all_baits(config, matrix, gene_table):
+    baits = gene_table.intern(sorted(set().union(*(
+        group['genes'] for group in config['bait_groups']['synthetic'].values()
+    ))))
+    return baits[matrix.get_rows(baits) != -1]
+
+def test_parse_matrix(measure, matrix_info):
+    def parse_matrix():
+        with open(matrix_info['path']) as f:
+            return parse.expression_matrix(clean.plain_text(f))
+    measure(parse_matrix)
+
+def test_parse_clustering(measure, matrix_info):
+    measure(_parse_clustering, matrix_info['clusterings']['clustering0'])
+
+def test_correlate_bait_group(measure, matrix, baits):
+    measure(matrix.correlate, baits)
+
+def test_correlate_all_bait_groups(measure, matrix, all_baits):
+    measure(matrix.correlate, all_baits)
+
+def test_rank_clusterings(measure, config, matrix_info, matrix, gene_table, baits):
+    registry = _ClusteringRegistry(None, gene_table)
+    stack = _ClusteringStack(matrix, registry.get_all(matrix_info['clusterings']).values())
+    selected = np.ones(len(matrix_info['clusterings']), dtype=bool)
+    def rank_clusterings():
+        ranking = _StackRanking(matrix.correlate(baits), matrix, baits, stack, selected)
+        return [(ranking.top(i, config['top_k']), ranking.get_ausr(i)) for i in range(len(selected))]
+    measure(rank_clusterings)
+
+def test_morph(measure, config):
+    measure(lambda: list(morph(config)))
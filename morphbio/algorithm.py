@@ -19,24 +19,62 @@
 Application programmer interface (API)
 '''
 
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import islice
+from pathlib import Path
+import hashlib
+import io
+import json
 import logging
+import multiprocessing
+import os
+import tempfile
+import threading
 
 from pytil.various import join_multiline
 from varbio import clean, parse
-from varbio.correlation import pearson_df
 import attr
+import numpy as np
 import pandas as pd
 import yaml
 
+from morphbio import cache
+from morphbio.profile import Profiler
+from morphbio.store import ResultStore
+
 
 # Note: if performance is an issue, profile the code to find the bottleneck. If
-# pandas is the problem, (partly) use numpy instead. Note that
-# varbio.correlation also has `pearson`, the plain numpy equivalent of
-# `pearson_df`.
+# pandas is the problem, (partly) use numpy instead, as _StackRanking and
+# _StandardisedMatrix do.
 
 _logger = logging.getLogger(__name__)
 
-def morph(config):
+# The C loader of libyaml is an order of magnitude faster, if installed
+_YamlLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+# Size in bytes of the blocks of rows gathered by _StandardisedMatrix.correlate
+# when only some rows are correlated
+_GATHER_BLOCK_SIZE = 2**24
+
+# Maximum size in bytes of the arrays of a batch of random bait sets, see
+# _get_p_value
+_PERMUTATION_BATCH_SIZE = 2**27
+
+# Version of the results of the algorithm, part of the result store key.
+# Increment when a change alters results.
+_ALGORITHM_VERSION = 4
+
+# Rough estimates of the seconds per unit of work, used by _CostModel. Measured
+# on a desktop CPU.
+_LOAD_MATRIX_SECONDS = 3e-7  # per value of the matrix
+_LOAD_CLUSTERING_SECONDS = 2e-6  # per gene of the clustering
+_CORRELATE_SECONDS = 5e-10  # per value of the matrix per bait
+_RANK_SECONDS = 5e-9  # per gene of the clustering per bait
+_PERMUTATION_SECONDS = 2e-8  # per gene of the clustering per bait per permutation
+
+def morph(config, jobs=1, ordered=False, skip=frozenset(), profiler=None, best_only=False):
     '''
     Run MORPH.
 
@@ -44,6 +82,35 @@ def morph(config):
     ----------
     config : ~typing.Dict
         Union of config.yaml and run_config.yaml. See user documentation.
+    jobs : int
+        Number of processes to run combinations in. If 1, run in the current
+        process.
+    ordered : bool
+        If ``jobs > 1``, whether to yield results in the same order as with
+        ``jobs=1``. Otherwise results are yielded as they complete.
+    skip : ~typing.Collection[~typing.Tuple[str, str, str]]
+        Combinations to skip, as (bait group id, matrix name, clustering name).
+        No result is yielded for these, e.g. as they were already done in a
+        previous run.
+    profiler : morphbio.profile.Profiler or None
+        If given, time and peak memory of each stage (``load_gene_mappings``,
+        ``load_matrix``, ``load_clusterings``, ``correlate`` and
+        ``rank_genes``) are recorded in
+        it, as well as the counters ``matrices`` and ``genes`` (number of
+        matrices loaded and their total number of genes), ``combinations``,
+        ``skipped_combinations`` and ``baits`` (summed over ranked
+        combinations). With ``permutations``, also the stage ``permute`` and
+        the counter ``permutations``. With a ``result_store``, also the stage
+        ``result_store`` and the counter ``reused_combinations``.
+    best_only : bool
+        If True, only the best ranking of each bait group is of interest. A
+        combination is abandoned if an upper bound on its AUSR does not exceed
+        the best AUSR found so far for its bait group, before its ranking and
+        p-value are calculated; the result then has ``skip_reason`` set.
+        Combinations which are not abandoned have a complete result, even if
+        their AUSR turns out not to exceed the best AUSR. Beware AUSRs of
+        abandoned combinations are therefore missing. Otherwise the AUSR of
+        every combination is calculated.
 
     Returns
     -------
@@ -59,47 +126,809 @@ def morph(config):
         excluded from the AUSR calculation.
     '''))
 
-    min_genes_present = 8
-    top_k = _get_top_k(config)
+    if jobs < 1:
+        raise ValueError('jobs must be >=1. Got: {!r}'.format(jobs))
+    if profiler is None:
+        profiler = Profiler()
+    settings = _get_settings(config)
+    with profiler.stage('load_gene_mappings'):
+        bait_groups_by_species = _tidy_grouped_bait_groups(config)
+    best_ausrs = {} if best_only else None  # bait group id -> best AUSR so far
+    store_dir = _get_result_store(config)
+    if store_dir is None:
+        yield from _run(config, bait_groups_by_species, skip, best_ausrs, jobs, ordered, settings, profiler)
+        return
+
+    # Yield stored results of combinations whose inputs did not change, compute
+    # and store the others
+    store = ResultStore(store_dir, settings.cache_dir)
+    with profiler.stage('result_store'):
+        keys = _get_result_keys(config, bait_groups_by_species, skip, store, settings)
+    skip = set(skip)
+    reused = 0
+    bait_group_names = {
+        group_id: group['name']
+        for bait_groups in bait_groups_by_species.values()
+        for group_id, group in bait_groups.items()
+    }
+    for combination, key in list(keys.items()):
+        with profiler.stage('result_store'):
+            entry = store.get(key)
+        if entry is None:
+            continue
+        group_id, matrix_name, clustering_name = combination
+        result = attr.evolve(
+            Result.from_dict(entry),
+            bait_group_id=group_id,
+            bait_group_name=bait_group_names[group_id],
+            matrix_name=matrix_name,
+            clustering_name=clustering_name,
+        )
+        if best_ausrs is not None:
+            _update_best_ausr(best_ausrs, result)
+        skip.add(combination)
+        del keys[combination]
+        reused += 1
+        profiler.count('reused_combinations')
+        yield result
+    _logger.info('Reused {} stored results, {} combinations left'.format(reused, len(keys)))
+    for result in _run(config, bait_groups_by_species, skip, best_ausrs, jobs, ordered, settings, profiler):
+        # Note: abandoned results depend on the AUSRs of other combinations, so
+        # they are not stored
+        abandoned = result.ausr is None and len(result.present_baits) >= settings.min_genes_present
+        if not abandoned:
+            with profiler.stage('result_store'):
+                store.put(keys[result.bait_group_id, result.matrix_name, result.clustering_name], result.to_dict())
+        yield result
+
+def _run(config, bait_groups_by_species, skip, best_ausrs, jobs, ordered, settings, profiler):
+    '''
+    Compute the results of all combinations not in skip.
+
+    See morph for the parameters.
+
+    Returns
+    -------
+    ~typing.Iterable[Result]
+    '''
+    tasks = _get_matrix_tasks(config, bait_groups_by_species, skip)
+    if jobs == 1:
+        # Load the next matrix in the background while ranking the current one
+        gene_table = _GeneTable()
+        clustering_registry = _ClusteringRegistry(settings.cache_dir, gene_table)
+        def load(task):
+            return _load_matrix(task[1], settings, gene_table, clustering_registry, profiler)
+        for (matrix_name, _, bait_groups, matrix_skip), (matrix, clusterings) in _prefetch(tasks, load):
+            yield from _morph_matrix(
+                matrix_name, matrix, clusterings, bait_groups, matrix_skip,
+                best_ausrs, gene_table, settings, profiler
+            )
+            del matrix, clusterings  # so at most 2 matrices are in memory
+    else:
+        # Split the bait groups of each matrix across the processes. Tasks are
+        # ordered by matrix, so each process loads each matrix at most once.
+        # The pool creates tasks lazily, so tasks get the best AUSRs known by
+        # the time they are sent to a process.
+        tasks = (
+            (
+                matrix_name, matrix_info, chunk, matrix_skip,
+                None if best_ausrs is None else {
+                    group_id: best_ausrs[group_id]
+                    for group_id in chunk
+                    if group_id in best_ausrs
+                },
+                settings
+            )
+            for matrix_name, matrix_info, chunk, matrix_skip, _ in _get_process_tasks(
+                tasks, jobs, ordered, _CostModel(settings)
+            )
+        )
+        with multiprocessing.Pool(jobs) as pool:
+            map_ = pool.imap if ordered else pool.imap_unordered
+            for results, profile in map_(_morph_task, tasks):
+                profiler.merge(profile)
+                if best_ausrs is not None:
+                    for result in results:
+                        _update_best_ausr(best_ausrs, result)
+                yield from results
+
+def _get_process_tasks(matrix_tasks, jobs, ordered, cost_model):
+    '''
+    Split the work per matrix into tasks for a pool of processes.
+
+    Unless ordered, the most expensive matrices go first and their bait groups
+    are split into chunks of similar estimated cost, most expensive first. So
+    the run does not end with a single process finishing a large task
+    (longest processing time first scheduling). Otherwise matrices are in
+    config order and their bait groups are split in order into chunks of
+    similar size.
+
+    Parameters
+    ----------
+    matrix_tasks : ~typing.Iterable[~typing.Tuple]
+        See _get_matrix_tasks.
+    jobs : int
+        Number of processes.
+    ordered : bool
+    cost_model : _CostModel
+
+    Returns
+    -------
+    ~typing.Iterable[~typing.Tuple[str, ~typing.Dict, ~typing.Dict, ~typing.Set[~typing.Tuple[str, str]], float]]
+        Matrix name, matrix info, chunk of bait groups, combinations to skip
+        and estimated seconds of each task.
+    '''
+    matrix_tasks = [
+        task + (cost_model.get_group_seconds(*task[1:]),)
+        for task in matrix_tasks
+    ]
+    if not ordered:
+        matrix_tasks.sort(key=lambda task: sum(task[4].values()), reverse=True)
+    for matrix_name, matrix_info, bait_groups, matrix_skip, group_seconds in matrix_tasks:
+        load_seconds = cost_model.get_load_seconds(matrix_info)
+        if ordered:
+            chunks = _chunk(bait_groups, jobs)
+        else:
+            chunks = _chunk_by_cost(bait_groups, group_seconds, jobs)
+        for chunk in chunks:
+            seconds = load_seconds + sum(group_seconds[group_id] for group_id in chunk)
+            yield matrix_name, matrix_info, chunk, matrix_skip, seconds
+
+def plan(config, jobs=1, ordered=False):
+    '''
+    Estimate the run time and peak memory of a MORPH run without running it.
+
+    Only the first lines of the expression matrices and clusterings are read,
+    their size is extrapolated from the size of their files. All baits are
+    assumed to be present. Estimates are rough, they are meant to compare
+    combinations and to size a run, e.g. the number of jobs or shards.
+
+    Parameters
+    ----------
+    config : ~typing.Dict
+        See morph.
+    jobs : int
+        See morph.
+    ordered : bool
+        See morph.
+
+    Returns
+    -------
+    Plan
+    '''
+    if jobs < 1:
+        raise ValueError('jobs must be >=1. Got: {!r}'.format(jobs))
+    settings = _get_settings(config)
     bait_groups_by_species = _tidy_grouped_bait_groups(config)
+    cost_model = _CostModel(settings)
+    tasks = list(_get_process_tasks(
+        _get_matrix_tasks(config, bait_groups_by_species, skip=()),
+        jobs, ordered or jobs == 1, cost_model
+    ))
+
+    # Estimate each combination and the peak memory of each task, with
+    # only the matrix and a single combination in memory at a time
+    combinations = []
+    task_memories = []
+    for matrix_name, matrix_info, bait_groups, _, _ in tasks:
+        matrix_memory = cost_model.get_matrix_memory(matrix_info)
+        task_memory = matrix_memory
+        for group_id, group in bait_groups.items():
+            for clustering_name in matrix_info['clusterings']:
+                seconds, memory = cost_model.get_combination(matrix_info, clustering_name, len(group['genes']))
+                combinations.append((
+                    group_id, matrix_name, clustering_name,
+                    len(group['genes']), seconds, matrix_memory + memory
+                ))
+                task_memory = max(task_memory, matrix_memory + memory)
+        task_memories.append(task_memory)
+    combinations = pd.DataFrame(
+        combinations,
+        columns=['bait_group_id', 'matrix_name', 'clustering_name', 'baits', 'seconds', 'memory']
+    )
+
+    # Each task goes to the first process to finish its previous task
+    finish_times = [0.0] * jobs
+    for task in tasks:
+        process = np.argmin(finish_times)
+        finish_times[process] += task[4]
+
+    if jobs == 1:
+        # The next matrix is loaded while ranking the current one
+        matrix_memories = [cost_model.get_matrix_memory(task[1]) for task in tasks]
+        memory = max(
+            (
+                task_memory + next_matrix_memory
+                for task_memory, next_matrix_memory in zip(task_memories, matrix_memories[1:] + [0])
+            ),
+            default=0
+        )
+    else:
+        memory = sum(sorted(task_memories, reverse=True)[:jobs])
+
+    return Plan(combinations, max(finish_times), memory)
+
+@attr.s(frozen=True)
+class Plan:
+
+    '''
+    Estimated cost of a MORPH run, see plan.
+
+    Attributes
+    ----------
+    combinations : ~pandas.DataFrame
+        Estimate of each combination in order of execution, with columns
+        ``bait_group_id``, ``matrix_name``, ``clustering_name``, ``baits``
+        (number of baits after mapping), ``seconds`` and ``memory`` (peak
+        memory in bytes, including the matrix).
+    seconds : float
+        Estimated wall time of the run.
+    memory : int
+        Estimated peak memory in bytes of the run, summed over processes.
+    '''
+
+    combinations = attr.ib()
+    seconds = attr.ib()
+    memory = attr.ib()
+
+class _CostModel:
+
+    '''
+    Estimates of the seconds and memory of the work of a run.
+
+    Matrix and clustering sizes are extrapolated from the first lines and the
+    size of their files. Baits are assumed to all be present.
+
+    Parameters
+    ----------
+    settings : _Settings
+    '''
+
+    def __init__(self, settings):
+        self._settings = settings
+        self._matrix_shapes = {}  # path -> (rows, columns)
+        self._clustering_sizes = {}  # path -> number of genes
+
+    def get_load_seconds(self, matrix_info):
+        '''
+        Get seconds to load matrix and its clusterings.
+        '''
+        rows, columns = self._get_matrix_shape(matrix_info['path'])
+        clustering_size = sum(map(self._get_clustering_size, matrix_info['clusterings'].values()))
+        return rows * columns * _LOAD_MATRIX_SECONDS + clustering_size * _LOAD_CLUSTERING_SECONDS
+
+    def get_matrix_memory(self, matrix_info):
+        '''
+        Get bytes of loaded matrix.
+        '''
+        rows, columns = self._get_matrix_shape(matrix_info['path'])
+        return int(rows * columns * self._settings.correlation_dtype.itemsize)
+
+    def get_combination(self, matrix_info, clustering_name, bait_count):
+        '''
+        Get seconds and peak memory in bytes of ranking a combination.
+
+        The correlation of the baits with the matrix, which is shared by the
+        clusterings of the matrix, is split evenly across them. Memory
+        excludes the matrix.
+        '''
+        rows, columns = self._get_matrix_shape(matrix_info['path'])
+        clustering_size = self._get_clustering_size(matrix_info['clusterings'][clustering_name])
+        seconds = rows * columns * bait_count * _CORRELATE_SECONDS / len(matrix_info['clusterings'])
+        if bait_count >= self._settings.min_genes_present:
+            seconds += clustering_size * bait_count * (
+                _RANK_SECONDS + self._settings.permutations * _PERMUTATION_SECONDS
+            )
+        # The correlations and about 4 arrays of them gathered per clustering
+        # gene while ranking
+        memory = (rows + 4 * clustering_size) * bait_count * self._settings.correlation_dtype.itemsize
+        return seconds, int(memory)
+
+    def get_group_seconds(self, matrix_info, bait_groups, skip):
+        '''
+        Get seconds to rank each bait group with the clusterings of a matrix.
+
+        Parameters
+        ----------
+        matrix_info : ~typing.Dict
+        bait_groups : ~typing.Mapping[str, ~typing.Dict]
+        skip : ~typing.Set[~typing.Tuple[str, str]]
+            Combinations to skip as (bait group id, clustering name).
+
+        Returns
+        -------
+        ~typing.Dict[str, float]
+            Seconds by bait group id.
+        '''
+        return {
+            group_id: sum(
+                self.get_combination(matrix_info, clustering_name, len(group['genes']))[0]
+                for clustering_name in matrix_info['clusterings']
+                if (group_id, clustering_name) not in skip
+            )
+            for group_id, group in bait_groups.items()
+        }
+
+    def _get_matrix_shape(self, path):
+        if path not in self._matrix_shapes:
+            lines, first_lines = _sample_lines(path)
+            columns = len(first_lines[1].split()) - 1 if len(first_lines) > 1 else 0
+            self._matrix_shapes[path] = (max(lines - 1, 0), columns)  # minus header
+        return self._matrix_shapes[path]
+
+    def _get_clustering_size(self, path):
+        if path not in self._clustering_sizes:
+            lines, first_lines = _sample_lines(path)
+            genes_per_line = np.mean([len(line.split()) - 1 for line in first_lines]) if first_lines else 0
+            self._clustering_sizes[path] = lines * genes_per_line
+        return self._clustering_sizes[path]
+
+def _sample_lines(path, count=100):
+    '''
+    Estimate the number of non-empty lines of a file from its first lines.
+
+    Returns
+    -------
+    ~typing.Tuple[float, ~typing.List[str]]
+        Estimated number of lines and the first non-empty lines.
+    '''
+    with open(path, 'rb') as f:
+        lines = list(islice(f, count))
+    size = os.path.getsize(path)
+    read = sum(map(len, lines))
+    first_lines = [line.decode(errors='replace') for line in lines if line.strip()]
+    if not first_lines:
+        return 0, []
+    if read >= size:
+        return len(first_lines), first_lines
+    return size / read * len(first_lines), first_lines
+
+class Ranker:
+
+    '''
+    MORPH with all expression matrices and clusterings of a config loaded, to
+    rank ad-hoc bait groups without loading data again.
+
+    Bait groups may be ranked concurrently from multiple threads.
+
+    Parameters
+    ----------
+    config : ~typing.Dict
+        config.yaml, see user documentation. Keys of run_config.yaml are
+        ignored.
+    top_k : int
+        Default number of best ranked genes to return.
+    '''
+
+    def __init__(self, config, top_k):
+        self._settings = _get_settings(dict(config, top_k=top_k))
+        self._gene_table = _GeneTable()
+        clustering_registry = _ClusteringRegistry(self._settings.cache_dir, self._gene_table)
+        profiler = Profiler()
+        self._species = {}  # species name -> (gene mapping, {matrix name: (matrix, clusterings, stack)})
+        for species_name, species in config['species'].items():
+            matrices = OrderedDict()
+            for matrix_name, matrix_info in species['expression_matrices'].items():
+                _logger.info('Loading {!r}'.format(matrix_name))
+                matrix, clusterings = _load_matrix(
+                    matrix_info, self._settings, self._gene_table,
+                    clustering_registry, profiler
+                )
+                matrices[matrix_name] = (matrix, clusterings, _ClusteringStack(matrix, clusterings.values()))
+            self._species[species_name] = (_get_gene_mapping(config, species_name), matrices)
+
+    @property
+    def species(self):
+        '''
+        Loaded data.
+
+        Returns
+        -------
+        ~typing.Dict[str, ~typing.Dict[str, ~typing.List[str]]]
+            Clustering names by matrix name by species name.
+        '''
+        return {
+            species_name: {
+                matrix_name: list(clusterings)
+                for matrix_name, (_, clusterings, _) in matrices.items()
+            }
+            for species_name, (_, matrices) in self._species.items()
+        }
+
+    def rank(self, species_name, genes, name='query', top_k=None):
+        '''
+        Run MORPH on a bait group.
+
+        Parameters
+        ----------
+        species_name : str
+        genes : ~typing.Iterable[str]
+            Baits. Gene mapping of the species applies.
+        name : str
+            Id and name of the bait group in the results.
+        top_k : int or None
+            Number of best ranked genes to return, if not the default.
+
+        Returns
+        -------
+        ~typing.List[Result]
+            The result of each matrix and clustering combination of the
+            species.
+
+        Raises
+        ------
+        ValueError
+            If the species is unknown or top_k is invalid.
+        '''
+        if species_name not in self._species:
+            raise ValueError('Unknown species: {!r}'.format(species_name))
+        settings = self._settings
+        if top_k is not None:
+            settings = attr.evolve(settings, top_k=_get_top_k({'top_k': top_k}))
+        gene_mapping, matrices = self._species[species_name]
+        bait_groups = _map_bait_groups({name: {'name': name, 'genes': list(genes)}}, gene_mapping)
+        results = []
+        for matrix_name, (matrix, clusterings, stack) in matrices.items():
+            results.extend(_morph_matrix(
+                matrix_name, matrix, clusterings, bait_groups, skip=(),
+                best_ausrs=None, gene_table=self._gene_table,
+                settings=settings, profiler=Profiler(), stack=stack
+            ))
+        return results
+
+@attr.s(frozen=True)
+class _Settings:
+
+    '''
+    Settings derived from config, shared by all combinations of a run.
+    '''
+
+    top_k = attr.ib()
+    correlation_cache_size = attr.ib()
+    correlation_dtype = attr.ib()
+    batch_correlations = attr.ib()
+    cache_dir = attr.ib()
+    matrix_block_size = attr.ib()
+    permutations = attr.ib()
+    permutation_seed = attr.ib()
+    min_genes_present = attr.ib(default=8)
+
+def _get_settings(config):
+    return _Settings(
+        top_k=_get_top_k(config),
+        correlation_cache_size=_get_correlation_cache_size(config),
+        correlation_dtype=_get_correlation_dtype(config),
+        batch_correlations=_get_batch_correlations(config),
+        cache_dir=_get_cache_dir(config),
+        matrix_block_size=_get_matrix_block_size(config),
+        permutations=_get_permutations(config),
+        permutation_seed=_get_permutation_seed(config),
+    )
+
+def _get_matrix_tasks(config, bait_groups_by_species, skip):
+    '''
+    Get the work to do per matrix, leaving out skipped combinations.
+
+    Returns
+    -------
+    ~typing.Iterable[~typing.Tuple[str, ~typing.Dict, ~typing.Dict, ~typing.Set[~typing.Tuple[str, str]]]]
+        Per matrix with work left: matrix name, matrix info from config, bait
+        groups with combinations left and combinations to skip as (bait group
+        id, clustering name).
+    '''
+    for species_name, bait_groups in bait_groups_by_species.items():
+        for matrix_name, matrix_info in config['species'][species_name]['expression_matrices'].items():
+            matrix_skip = {
+                (group_id, clustering_name)
+                for group_id, matrix_name_, clustering_name in skip
+                if matrix_name_ == matrix_name
+            }
+            bait_groups_left = {
+                group_id: group
+                for group_id, group in bait_groups.items()
+                if any((group_id, clustering_name) not in matrix_skip for clustering_name in matrix_info['clusterings'])
+            }
+            if bait_groups_left:
+                yield matrix_name, matrix_info, bait_groups_left, matrix_skip
+
+def _get_result_keys(config, bait_groups_by_species, skip, store, settings):
+    '''
+    Get result store key of each combination not in skip.
+
+    A key is the hash of the content of the matrix and clustering file, the
+    bait group's baits after gene mapping, the settings affecting results and
+    `_ALGORITHM_VERSION`. Names are not part of the key, so renaming a matrix,
+    clustering or bait group does not invalidate its results.
+
+    Returns
+    -------
+    ~typing.Dict[~typing.Tuple[str, str, str], str]
+        Key by (bait group id, matrix name, clustering name).
+    '''
+    keys = {}
     for species_name, bait_groups in bait_groups_by_species.items():
-        species_info = config['species'][species_name]
-        _logger.info('Ranking {!r} bait groups'.format(species_name))
-        for matrix_name, matrix_info in species_info['expression_matrices'].items():
-            with open(matrix_info['path']) as f:
-                matrix = parse.expression_matrix(clean.plain_text(f))
-            clusterings = _parse_clusterings(matrix_info['clusterings'])
-            for group_id, group in bait_groups.items():
-                group_name = group['name']
-                baits = group['genes']
-                baits_in_matrix = matrix.index.intersection(baits)
-                correlations = pearson_df(matrix, matrix.loc[baits_in_matrix])
-                for clustering_name, clustering in clusterings.items():
-                    baits_in_both = clustering.index.intersection(baits_in_matrix)
-
-                    # Skip if not enough baits left
-                    log_prefix = '{!r}: {!r}: {!r}:'.format(matrix_name, group_name, clustering_name)
-                    baits_present_msg = '{} {}/{} baits present in matrix and clustering.'.format(log_prefix, len(baits_in_both), len(baits))
-                    missing_baits = baits_in_both.difference(baits_in_both)
-                    if len(baits_in_both) < min_genes_present:
-                        skip_reason = 'need at least {} baits present'.format(min_genes_present)
-                        _logger.info('{} Skipping; {}'.format(baits_present_msg, skip_reason))
-                        yield Result(
-                            group_id, group_name, matrix_name, clustering_name,
-                            baits_in_both, missing_baits, ranking=None,
-                            ausr=None, skip_reason=skip_reason
-                        )
+        for matrix_name, matrix_info in config['species'][species_name]['expression_matrices'].items():
+            matrix_hash = store.hash_file(matrix_info['path'])
+            for clustering_name, clustering_path in matrix_info['clusterings'].items():
+                clustering_hash = store.hash_file(clustering_path)
+                for group_id, group in bait_groups.items():
+                    combination = (group_id, matrix_name, clustering_name)
+                    if combination in skip:
                         continue
+                    key = json.dumps([
+                        _ALGORITHM_VERSION, settings.top_k,
+                        settings.correlation_dtype.name,
+                        settings.min_genes_present, settings.permutations,
+                        settings.permutation_seed, matrix_hash,
+                        clustering_hash, sorted(group['genes'])
+                    ])
+                    keys[combination] = hashlib.sha1(key.encode()).hexdigest()
+    return keys
+
+def _load_matrix(matrix_info, settings, gene_table, clustering_registry, profiler):
+    '''
+    Load expression matrix and its clusterings.
+
+    Returns
+    -------
+    ~typing.Tuple[_StandardisedMatrix, ~typing.Mapping[str, _Clustering]]
+        Matrix and clusterings, see _ClusteringRegistry.get_all.
+    '''
+    def standardise():
+        if settings.matrix_block_size is not None:
+            return _standardise_file(
+                matrix_info['path'], settings.correlation_dtype,
+                settings.matrix_block_size, settings.cache_dir
+            )
+        with open(matrix_info['path']) as f:
+            matrix = parse.expression_matrix(clean.plain_text(f))
+        return {
+            'genes': np.asarray(matrix.index, dtype=str),
+            'values': _standardise(matrix.values, settings.correlation_dtype),
+        }
+    with profiler.stage('load_matrix'):
+        arrays = cache.load(
+            settings.cache_dir, matrix_info['path'],
+            'standardised_matrix_v2_{}'.format(settings.correlation_dtype.name),
+            standardise
+        )
+        matrix = _StandardisedMatrix(
+            gene_table.intern(arrays['genes']), arrays['values'],
+            settings.matrix_block_size
+        )
+    profiler.count('matrices')
+    profiler.count('genes', len(matrix.genes))
+    with profiler.stage('load_clusterings'):
+        clusterings = clustering_registry.get_all(matrix_info['clusterings'])
+
+    # Genes in none of the clusterings are never ranked, so do not correlate
+    # them
+    rows = np.unique(np.concatenate([matrix.get_rows(clustering.genes) for clustering in clusterings.values()]))
+    rows = rows[rows != -1]
+    if len(rows) < len(matrix.genes):
+        _logger.info(
+            'Correlating only the {}/{} rows of expression matrix whose genes '
+            'appear in a clustering'.format(len(rows), len(matrix.genes))
+        )
+        matrix = matrix.restrict(rows)
+    return matrix, clusterings
+
+def _morph_matrix(matrix_name, matrix, clusterings, bait_groups, skip, best_ausrs, gene_table, settings, profiler, stack=None):
+    '''
+    Run MORPH on each bait group and clustering combination of a matrix.
+
+    Parameters
+    ----------
+    matrix_name : str
+    matrix : _StandardisedMatrix
+    clusterings : ~typing.Mapping[str, _Clustering]
+        See _ClusteringRegistry.get_all.
+    bait_groups : ~typing.Mapping[str, ~typing.Dict]
+        Tidied bait groups by id, see _tidy_bait_groups.
+    skip : ~typing.Collection[~typing.Tuple[str, str]]
+        Combinations to skip as (bait group id, clustering name).
+    best_ausrs : ~typing.Dict[str, float] or None
+        If not None, best AUSR so far by bait group id, see best_only of morph.
+        Updated as better AUSRs are found.
+    gene_table : _GeneTable
+        Table the gene ids of matrix and clusterings are from. Baits are
+        looked up in it, not added to it.
+    settings : _Settings
+    profiler : morphbio.profile.Profiler
+    stack : _ClusteringStack or None
+        Stack of the clusterings. Built if None.
+
+    Returns
+    -------
+    ~typing.Iterable[Result]
+    '''
+    _logger.info('Ranking bait groups with {!r}'.format(matrix_name))
+    if settings.batch_correlations:
+        all_baits = gene_table.lookup(sorted(set().union(*(group['genes'] for group in bait_groups.values()))))
+        with profiler.stage('correlate'):
+            bait_correlations = _BatchedCorrelations(matrix, all_baits[matrix.get_rows(all_baits) != -1])
+    else:
+        bait_correlations = _CorrelationCache(matrix, settings.correlation_cache_size)
+    if stack is None:
+        with profiler.stage('rank_genes'):
+            stack = _ClusteringStack(matrix, clusterings.values())
+    for group_id, group in bait_groups.items():
+        group_name = group['name']
+        bait_names = pd.Index(sorted(group['genes']), dtype=object)
+        baits = gene_table.lookup(bait_names)
+        in_matrix = matrix.get_rows(baits) != -1
+        with profiler.stage('correlate'):
+            correlations = bait_correlations.get(baits[in_matrix])
+
+        # Skip combinations without enough baits, rank the others together
+        selected = np.zeros(len(clusterings), dtype=bool)
+        combinations = []
+        for i, (clustering_name, clustering) in enumerate(clusterings.items()):
+            if (group_id, clustering_name) in skip:
+                continue
+            in_both = in_matrix & clustering.contains(baits)
+            baits_in_both = baits[in_both]
+            present_baits = bait_names[in_both]
+            missing_baits = bait_names[~in_both]
+            log_prefix = '{!r}: {!r}: {!r}:'.format(matrix_name, group_name, clustering_name)
+            baits_present_msg = '{} {}/{} baits present in matrix and clustering.'.format(log_prefix, len(baits_in_both), len(baits))
+            if len(baits_in_both) < settings.min_genes_present:
+                skip_reason = 'need at least {} baits present'.format(settings.min_genes_present)
+                _logger.info('{} Skipping; {}'.format(baits_present_msg, skip_reason))
+                profiler.count('skipped_combinations')
+            else:
+                _logger.info('{} Calculating'.format(baits_present_msg))
+                skip_reason = None
+                selected[i] = True
+            combinations.append((i, clustering_name, clustering, present_baits, missing_baits, log_prefix, skip_reason))
+        if selected.any():
+            with profiler.stage('rank_genes'):
+                ranking = _StackRanking(correlations, matrix, baits[in_matrix], stack, selected)
+
+        for i, clustering_name, clustering, present_baits, missing_baits, log_prefix, skip_reason in combinations:
+            if skip_reason is not None:
+                yield Result(
+                    group_id, group_name, matrix_name, clustering_name,
+                    present_baits, missing_baits, ranking=None,
+                    ausr=None, skip_reason=skip_reason
+                )
+                continue
+            profiler.count('combinations')
+            profiler.count('baits', len(present_baits))
+
+            # Abandon if it cannot exceed the best AUSR so far, before
+            # comparing to other clusters, taking the top k and permuting
+            min_ausr = None if best_ausrs is None else best_ausrs.get(group_id)
+            if min_ausr is not None and ranking.get_max_ausr(i) <= min_ausr:
+                skip_reason = 'cannot exceed best AUSR of bait group, {}'.format(min_ausr)
+                _logger.info('{} Abandoned; {}'.format(log_prefix, skip_reason))
+                profiler.count('abandoned_combinations')
+                yield Result(
+                    group_id, group_name, matrix_name, clustering_name,
+                    present_baits, missing_baits, ranking=None,
+                    ausr=None, skip_reason=skip_reason
+                )
+                continue
+
+            with profiler.stage('rank_genes'):
+                ausr = ranking.get_ausr(i)
+                top = ranking.top(i, settings.top_k)
+            p_value = None
+            if settings.permutations:
+                rng = _get_permutation_rng(settings.permutation_seed, bait_names)
+                with profiler.stage('permute'):
+                    p_value = _get_p_value(matrix, clustering, len(present_baits), ausr, settings.permutations, rng)
+                profiler.count('permutations', settings.permutations)
+            _logger.info('{} AUSR={} p-value={}'.format(log_prefix, ausr, p_value))
+            top = pd.Series(top.values, index=gene_table.names(top.index))
+            result = Result(
+                group_id, group_name, matrix_name, clustering_name,
+                present_baits, missing_baits, top,
+                ausr, skip_reason=None, p_value=p_value
+            )
+            if best_ausrs is not None:
+                _update_best_ausr(best_ausrs, result)
+            yield result
+
+def _prefetch(items, load):
+    '''
+    Load each item in a background thread, one item ahead of the consumer.
+
+    While the consumer processes an item, the next item is loaded. The caller
+    should drop its references to a loaded item before requesting the next, so
+    at most 2 loaded items are in memory.
+
+    Parameters
+    ----------
+    items : ~typing.Iterable
+    load : ~typing.Callable
+        Called with an item, in a background thread.
+
+    Returns
+    -------
+    ~typing.Iterable[~typing.Tuple]
+        Each item and what load returned for it, in order of items.
+    '''
+    items = iter(items)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        item = next(items, None)
+        future = None if item is None else executor.submit(load, item)
+        while future is not None:
+            loaded = future.result()
+            next_item = next(items, None)
+            future = None if next_item is None else executor.submit(load, next_item)
+            yield item, loaded
+            loaded = None
+            item = next_item
+
+def _update_best_ausr(best_ausrs, result):
+    '''
+    Update best AUSR of result's bait group.
+    '''
+    if result.ausr is not None and result.ausr > best_ausrs.get(result.bait_group_id, -np.inf):
+        best_ausrs[result.bait_group_id] = result.ausr
+
+# Matrix last loaded by _morph_task in this process: (path, matrix, clusterings)
+_task_matrix = None
+
+# Gene table and clusterings of _morph_task in this process
+_task_gene_table = None
+_task_clustering_registry = None
+
+def _morph_task(task):
+    '''
+    Run _morph_matrix in a worker process.
+
+    Parameters
+    ----------
+    task : ~typing.Tuple[str, ~typing.Dict, ~typing.Mapping[str, ~typing.Dict], ~typing.Set[~typing.Tuple[str, str]], ~typing.Dict[str, float], _Settings]
+        Arguments of _morph_matrix, but with matrix info from config instead
+        of the loaded matrix and clusterings.
+
+    Returns
+    -------
+    ~typing.Tuple[~typing.List[Result], ~typing.Dict]
+        Results and profile of the task, see Profiler.to_dict.
+    '''
+    global _task_matrix, _task_gene_table, _task_clustering_registry
+    matrix_name, matrix_info, bait_groups, skip, best_ausrs, settings = task
+    profiler = Profiler()
+    if _task_clustering_registry is None:
+        _task_gene_table = _GeneTable()
+        _task_clustering_registry = _ClusteringRegistry(settings.cache_dir, _task_gene_table)
+    if _task_matrix is None or _task_matrix[0] != matrix_info['path']:
+        _task_matrix = None  # free the previous matrix before loading the next
+        _task_matrix = (matrix_info['path'],) + _load_matrix(
+            matrix_info, settings, _task_gene_table, _task_clustering_registry, profiler
+        )
+    _, matrix, clusterings = _task_matrix
+    results = list(_morph_matrix(
+        matrix_name, matrix, clusterings, bait_groups, skip, best_ausrs,
+        _task_gene_table, settings, profiler
+    ))
+    return results, profiler.to_dict()
 
-                    #
-                    _logger.info('{} Calculating'.format(baits_present_msg))
-                    ranking, ausr = _rank_genes(correlations[baits_in_both], clustering, baits_in_both)
-                    _logger.info('{} AUSR={}'.format(log_prefix, ausr))
-                    yield Result(
-                        group_id, group_name, matrix_name, clustering_name,
-                        baits_in_both, missing_baits, ranking.iloc[:top_k],
-                        ausr, skip_reason=None
-                    )
+def _chunk(bait_groups, count):
+    '''
+    Split bait groups into at most count chunks of similar size.
+    '''
+    items = list(bait_groups.items())
+    size = max(1, -(-len(items) // count))  # ceil
+    return [dict(items[i:i+size]) for i in range(0, len(items), size)]
+
+def _chunk_by_cost(bait_groups, seconds, count):
+    '''
+    Split bait groups into at most count chunks of similar estimated seconds.
+
+    Most expensive bait groups are assigned first, each to the cheapest chunk
+    so far. Chunks are returned most expensive first.
+    '''
+    chunks = [(0.0, i, {}) for i in range(count)]  # (seconds, index, bait groups)
+    for group_id in sorted(bait_groups, key=seconds.get, reverse=True):
+        chunk_seconds, i, chunk = min(chunks)
+        chunk[group_id] = bait_groups[group_id]
+        chunks[i] = (chunk_seconds + seconds[group_id], i, chunk)
+    return [chunk for _, _, chunk in sorted(chunks, key=lambda chunk: -chunk[0]) if chunk]
 
 @attr.s(frozen=True, slots=True)
 class Result:
@@ -130,6 +959,9 @@ class Result:
         AUSR of the ranking. Or `None` if this combination was skipped.
     skip_reason : str or None
         Reason the combination was skipped or `None` if it wasn't skipped.
+    p_value : float or None
+        Empirical p-value of the AUSR, see the ``permutations`` option. Or
+        `None` if not calculated or this combination was skipped.
     '''
 
     bait_group_id = attr.ib()
@@ -141,93 +973,836 @@ class Result:
     ranking = attr.ib()
     ausr = attr.ib()
     skip_reason = attr.ib()
+    p_value = attr.ib(default=None)
+
+    def to_dict(self):
+        '''
+        Get result as JSON serialisable dict.
+
+        Returns
+        -------
+        ~typing.Dict
+            Attributes by name. Baits are lists and the ranking is a list of
+            (gene, score) pairs.
+        '''
+        result = attr.asdict(self, recurse=False)
+        result['present_baits'] = list(self.present_baits)
+        result['missing_baits'] = list(self.missing_baits)
+        if self.ranking is not None:
+            result['ranking'] = list(zip(self.ranking.index, self.ranking.values.tolist()))
+        if self.ausr is not None:
+            result['ausr'] = float(self.ausr)
+        if self.p_value is not None:
+            result['p_value'] = float(self.p_value)
+        return result
+
+    @classmethod
+    def from_dict(cls, result):
+        '''
+        Inverse of `to_dict`.
+        '''
+        result = dict(result)
+        ranking = result['ranking']
+        if ranking is not None:
+            genes, scores = zip(*ranking) if ranking else ((), ())
+            ranking = pd.Series(scores, index=pd.Index(genes), dtype=float)
+        result.update(
+            present_baits=pd.Index(result['present_baits']),
+            missing_baits=pd.Index(result['missing_baits']),
+            ranking=ranking,
+        )
+        return cls(**result)
+
+class _StandardisedMatrix:
+
+    '''
+    Expression matrix with each row centred and scaled to unit length.
+
+    The Pearson correlation of 2 genes is the dot product of their rows, so
+    correlating any number of baits with all genes takes a single matrix
+    product.
+
+    Parameters
+    ----------
+    genes : ~numpy.ndarray
+        Gene id of each row of `values`, see _GeneTable.
+    values : ~numpy.ndarray
+        Standardised rows, see _standardise. May be memory-mapped.
+    block_size : int or None
+        If given, correlate the matrix block of rows by block of rows of at
+        most this many bytes, so that only a block needs to be in memory when
+        values is memory-mapped. Otherwise correlate all rows at once.
+    rows : ~numpy.ndarray or None
+        If given, the sorted rows to correlate. Correlations of other rows are
+        NaN. Otherwise all rows are correlated.
+
+    Attributes
+    ----------
+    genes : ~numpy.ndarray
+    values : ~numpy.ndarray
+    '''
 
-def _rank_genes(correlations, clustering):
+    def __init__(self, genes, values, block_size=None, rows=None):
+        self.genes = genes
+        self.values = values
+        self._block_size = block_size
+        self._correlated_rows = rows
+        self._rows = np.full(genes.max() + 1 if len(genes) else 0, -1, dtype=np.intp)  # gene id -> row
+        self._rows[genes] = np.arange(len(genes))
+
+    def get_rows(self, genes):
+        '''
+        Get row of each gene.
+
+        Parameters
+        ----------
+        genes : ~numpy.ndarray
+            Gene ids.
+
+        Returns
+        -------
+        ~numpy.ndarray
+            Row of each gene, -1 if not in the matrix.
+        '''
+        rows = np.full(len(genes), -1, dtype=np.intp)
+        known = (genes >= 0) & (genes < len(self._rows))
+        rows[known] = self._rows[genes[known]]
+        return rows
+
+    def correlate(self, baits):
+        '''
+        Get correlations between baits and all genes.
+
+        Parameters
+        ----------
+        baits : ~numpy.ndarray
+            Gene ids of baits, each must be in the expression matrix.
+
+        Returns
+        -------
+        ~numpy.ndarray
+            Correlations with genes as rows and baits as columns.
+        '''
+        bait_values = np.array(self.values[self.get_rows(baits)])
+        rows = self._correlated_rows
+        if rows is None and self._block_size is None:
+            return self.values @ bait_values.T
+        block_rows = _get_block_rows(self._block_size or _GATHER_BLOCK_SIZE, self.values.shape[1], self.values.dtype)
+        if rows is None:
+            correlations = np.empty((len(self.values), len(baits)), dtype=self.values.dtype)
+            for start in range(0, len(self.values), block_rows):
+                block = slice(start, start + block_rows)
+                correlations[block] = self.values[block] @ bait_values.T
+        else:
+            correlations = np.full((len(self.values), len(baits)), np.nan, dtype=self.values.dtype)
+            for start in range(0, len(rows), block_rows):
+                block = rows[start:start + block_rows]
+                correlations[block] = self.values[block] @ bait_values.T
+        return correlations
+
+    def restrict(self, rows):
+        '''
+        Get matrix which only correlates the given rows.
+
+        Values are shared, not copied.
+
+        Parameters
+        ----------
+        rows : ~numpy.ndarray
+            Sorted rows to correlate.
+
+        Returns
+        -------
+        _StandardisedMatrix
+        '''
+        return _StandardisedMatrix(self.genes, self.values, self._block_size, rows)
+
+def _standardise(values, dtype):
     '''
-    Rank genes by correlations and clustering.
+    Centre each row and scale it to unit length.
 
     Parameters
     ----------
-    correlations : ~pandas.DataFrame
-        Correlations between baits and all genes in expression matrix. Column
-        names are baits, index names are all genes.
-    clustering : ~pandas.Series
-        Clustering as series with gene names as index, cluster names as values
-        and ``cluster`` as series name.
+    values : ~numpy.ndarray
+        Expression matrix values.
+    dtype : ~numpy.dtype
+        Data type of the result.
 
     Returns
     -------
-    ~typing.Tuple[pandas.Series, float]
-        Ranking and its AUSR.
-    '''
-    # Take only row genes present in clustering and add 'cluster' column
-    original_row_count = len(correlations)
-    correlations = correlations.join(clustering, how='inner')
-    dropped_rows = original_row_count - len(correlations)
-    if dropped_rows:
-        _logger.info(join_multiline(
-            '''
-            Ignoring {}/{} rows from expression matrix because the corresponding
-            genes do not appear in the clustering.
-            '''
-            .format(dropped_rows, original_row_count)
-        ))
-
-    # Calculate ranking
-    pre_ranking = []
-    ranking = []
-    for _, corrs in correlations.groupby('cluster'):
-        corrs = corrs.drop('cluster', axis=1)
-        cluster_baits = corrs.columns.intersection(corrs.index).to_series()  # baits in cluster
-        if not cluster_baits.empty: # only clusters with baits
-            pre_ranking.append(corrs[cluster_baits].sum(axis=1))
-            ranking.append(_finalise(pre_ranking[-1], cluster_baits))
-    pre_ranking = pd.concat(pre_ranking)
-    ranking = pd.concat(ranking)
-
-    # For each bait, leave it out, calculate ranking based on pre_ranking
-    # and check its position in the ranking
-    tmp_ranking = pre_ranking.copy()
-    indices = []
-    for _, corrs in correlations.groupby('cluster'):
-        corrs = corrs.drop('cluster', axis=1)
-        cluster_baits = corrs.columns.intersection(corrs.index).to_series()  # baits in cluster
-        if not cluster_baits.empty:
-            for bait in cluster_baits:
-                tmp_ranking.loc[corrs.index] = pre_ranking.loc[corrs.index] - corrs[bait]
-                _finalise(tmp_ranking.loc[corrs.index], cluster_baits.drop(bait))
-                tmp_ranking.sort_values(inplace=True)
-                indices.append(tmp_ranking.index.get_loc(bait))
-            tmp_ranking = pre_ranking.copy()
-
-    # Apply area under the curve to indices to get the AUSR
-    ausr = _get_auc(pd.Series(indices))
-
-    return ranking, ausr
-
-def _normalise(ranking):
-    return (ranking - ranking.values.mean()) / ranking.values.std()
-
-def _finalise(ranking, baits):
-    '''
-    Finalise ranking, see _rank_genes.
+    ~numpy.ndarray
+        Standardised rows. Rows of genes with constant expression are 0, so
+        their correlations are 0, like the NaN correlations skipped by sums in
+        previous versions.
+    '''
+    values = values.astype(np.float64)
+    values -= values.mean(axis=1, keepdims=True)
+    norms = np.linalg.norm(values, axis=1, keepdims=True)
+    norms[norms == 0] = 1  # constant row, leave it 0
+    values /= norms
+    return values.astype(dtype, copy=False)
+
+def _standardise_file(path, dtype, block_size, directory):
+    '''
+    Standardise expression matrix file block of rows by block of rows.
+
+    Only a block of at most block_size bytes of rows is parsed at a time. The
+    standardised rows are written to a memory-mapped ``.npy`` file, so the
+    matrix need not fit in memory.
 
     Parameters
     ----------
-    ranking : pandas.Series
-    baits : ~pandas.Series
-        Series with bait gene names as values.
+    path : str
+        Expression matrix file.
+    dtype : ~numpy.dtype
+    block_size : int
+        Maximum size of a parsed block in bytes.
+    directory : ~pathlib.Path
+        Directory to create the ``.npy`` file in.
+
+    Returns
+    -------
+    ~typing.Dict[str, ~numpy.ndarray or ~pathlib.Path]
+        ``genes`` array and ``values`` as path of the ``.npy`` file, see
+        morphbio.cache.load.
+    '''
+    # Count rows and columns first, to allocate the file
+    with open(path) as f:
+        lines = (line for line in clean.plain_text(f) if line.strip())
+        next(lines)  # header
+        first = next(lines, None)
+        row_count = sum(1 for _ in lines) + (first is not None)
+    column_count = 0 if first is None else len(first.split()) - 1
+    block_rows = _get_block_rows(block_size, column_count, np.dtype(np.float64))
+
+    # Parse and standardise each block with the header of the file
+    Path(directory).mkdir(parents=True, exist_ok=True)
+    fd, values_file = tempfile.mkstemp(dir=str(directory), prefix='.tmp', suffix='.npy')
+    os.close(fd)
+    try:
+        values = np.lib.format.open_memmap(values_file, mode='w+', dtype=dtype, shape=(row_count, column_count))
+        genes = []
+        with open(path) as f:
+            lines = (line for line in clean.plain_text(f) if line.strip())
+            header = next(lines)
+            while True:
+                block_lines = list(islice(lines, block_rows))
+                if not block_lines:
+                    break
+                block = parse.expression_matrix(io.StringIO(header + ''.join(block_lines)))
+                values[len(genes):len(genes) + len(block)] = _standardise(block.values, dtype)
+                genes.extend(block.index)
+        if len(genes) != row_count:
+            raise ValueError(
+                'Expected {} rows in expression matrix {}, parsed {}'
+                .format(row_count, path, len(genes))
+            )
+        values.flush()
+        del values
+    except BaseException:
+        os.remove(values_file)
+        raise
+    return {'genes': np.array(genes, dtype=str), 'values': Path(values_file)}
+
+def _get_block_rows(block_size, column_count, dtype):
     '''
-    non_baits = ~ranking.index.isin(baits)
-    ranking = ranking.loc[non_baits]
-    if not ranking.empty:
-        ranking = ranking / len(baits)
-        ranking = _normalise(ranking)
-    return ranking
+    Get number of rows of a block of at most block_size bytes, at least 1.
+    '''
+    return max(1, block_size // max(1, column_count * dtype.itemsize))
+
+class _BatchedCorrelations:
+
+    '''
+    Correlations between all genes of an expression matrix and a fixed set of
+    baits, calculated up front in a single matrix product.
+
+    Parameters
+    ----------
+    matrix : _StandardisedMatrix
+    baits : ~numpy.ndarray
+        Gene ids of all baits to correlate, e.g. the union of all bait groups.
+        Each must be in the expression matrix.
+    '''
+
+    def __init__(self, matrix, baits):
+        self._columns = {bait: column for column, bait in enumerate(baits.tolist())}
+        self._correlations = matrix.correlate(baits)
+
+    def get(self, baits):
+        '''
+        Get correlations between baits and all genes in the expression matrix.
+
+        Parameters
+        ----------
+        baits : ~numpy.ndarray
+            Gene ids of baits, a subset of those given to the constructor.
+
+        Returns
+        -------
+        ~numpy.ndarray
+            Correlations with genes as rows and baits as columns.
+        '''
+        return self._correlations[:, [self._columns[bait] for bait in baits.tolist()]]
+
+class _CorrelationCache:
+
+    '''
+    Least recently used cache of correlations between baits and the genes of an
+    expression matrix.
+
+    Bait groups often share baits, caching avoids correlating the same bait
+    with the matrix again for each group.
+
+    Parameters
+    ----------
+    matrix : _StandardisedMatrix
+    max_size : int
+        Maximum size of the cached correlations in bytes.
+    '''
+
+    def __init__(self, matrix, max_size):
+        self._matrix = matrix
+        self._max_size = max_size
+        self._correlations = OrderedDict()  # bait gene id -> correlations, least recently used first
+        self._size = 0
+
+    def get(self, baits):
+        '''
+        Get correlations between baits and all genes in the expression matrix.
+
+        Parameters
+        ----------
+        baits : ~numpy.ndarray
+            Gene ids of baits, each must be in the expression matrix.
+
+        Returns
+        -------
+        ~numpy.ndarray
+            Correlations with genes as rows and baits as columns.
+        '''
+        baits = baits.tolist()
+
+        # Correlate missing baits in one go
+        missing = [bait for bait in baits if bait not in self._correlations]
+        if missing:
+            correlations = self._matrix.correlate(np.array(missing, dtype=np.int32))
+            for bait, bait_correlations in zip(missing, correlations.T):
+                self._correlations[bait] = bait_correlations.copy()  # copy, so the rest can be freed
+                self._size += bait_correlations.nbytes
+
+        # Get requested baits and mark them as most recently used
+        columns = []
+        for bait in baits:
+            self._correlations.move_to_end(bait)
+            columns.append(self._correlations[bait])
+        correlations = np.column_stack(columns) if columns else np.empty((len(self._matrix.genes), 0))
+
+        # Evict least recently used
+        while self._size > self._max_size and self._correlations:
+            _, evicted = self._correlations.popitem(last=False)
+            self._size -= evicted.nbytes
+
+        return correlations
+
+class _ClusteringStack:
+
+    '''
+    Clusterings of a matrix stacked into a single gene by cluster indicator.
+
+    The indicator is sparse, as the row in the matrix and cluster code of each
+    entry. Cluster codes are offset per clustering so that codes are unique
+    across clusterings. Entries are sorted by code, so that each cluster and
+    each clustering is a contiguous slice of entries.
+
+    Only depends on the matrix and clusterings, so it is shared by all bait
+    groups, see _StackRanking.
+
+    Parameters
+    ----------
+    matrix : _StandardisedMatrix
+    clusterings : ~typing.Iterable[_Clustering]
+
+    Attributes
+    ----------
+    rows : ~numpy.ndarray
+        Row in matrix of each entry.
+    codes : ~numpy.ndarray
+        Cluster code of each entry, sorted.
+    bounds : ~numpy.ndarray
+        ``bounds[i]:bounds[i+1]`` are the entries of the i-th clustering.
+    code_clusterings : ~numpy.ndarray
+        Index of the clustering of each cluster code.
+    entry_order : ~numpy.ndarray
+        Entries sorted by row, to look up the entries of genes.
+    '''
+
+    def __init__(self, matrix, clusterings):
+        rows = []
+        codes = []
+        code_clusterings = []
+        code_count = 0
+        for i, clustering in enumerate(clusterings):
+            rows_, codes_ = _get_entries(matrix, clustering)
+            dropped_rows = len(matrix.genes) - len(np.unique(rows_))
+            if dropped_rows:
+                _logger.info(join_multiline(
+                    '''
+                    Ignoring {}/{} rows from expression matrix because the
+                    corresponding genes do not appear in the clustering.
+                    '''
+                    .format(dropped_rows, len(matrix.genes))
+                ))
+            clustering_code_count = codes_.max() + 1 if len(codes_) else 0
+            rows.append(rows_)
+            codes.append(codes_.astype(np.intp) + code_count)
+            code_clusterings.append(np.full(clustering_code_count, i, dtype=np.intp))
+            code_count += clustering_code_count
+        self.rows = np.concatenate(rows) if rows else np.empty(0, dtype=np.intp)
+        self.codes = np.concatenate(codes) if codes else np.empty(0, dtype=np.intp)
+        self.bounds = np.cumsum([0] + [len(rows_) for rows_ in rows])
+        self.code_clusterings = np.concatenate(code_clusterings) if code_clusterings else np.empty(0, dtype=np.intp)
+        self.entry_order = np.argsort(self.rows, kind='stable')
+
+class _StackRanking:
+
+    '''
+    Ranking of genes by correlations and each of the clusterings of a stack.
+
+    Genes are scored by the sum of their correlations to the baits in their
+    cluster, normalised within the cluster. Only genes in clusters with baits
+    are ranked, baits themselves are not ranked. Leaving out a bait only
+    changes the ranking of its own cluster, so the position of a left out bait
+    is the number of genes of other clusters which rank better plus the number
+    of genes in its own cluster which rank better.
+
+    All selected clusterings are scored and their baits left out together with
+    array operations over the stacked clusterings. The sum of the correlations
+    of each gene to the baits of its cluster is a sparse product of the stacked
+    indicator, the correlations and the indicator of the baits of each cluster;
+    only the genes of clusters with baits contribute. Comparing left out baits
+    to the genes of other clusters and taking the top k are done per
+    clustering, on request, so that a clustering whose AUSR cannot exceed a
+    best AUSR can be skipped, see get_max_ausr.
+
+    Parameters
+    ----------
+    correlations : ~numpy.ndarray
+        Correlations between all genes in expression matrix (rows) and baits
+        (columns).
+    matrix : _StandardisedMatrix
+        Expression matrix the correlations are of.
+    baits : ~numpy.ndarray
+        Gene id of the bait of each column of correlations. Baits need not be
+        in each clustering.
+    stack : _ClusteringStack
+    selected : ~numpy.ndarray
+        Whether to rank each clustering of the stack.
+    '''
+
+    def __init__(self, correlations, matrix, baits, stack, selected):
+        rows = stack.rows
+        codes = stack.codes
+        code_count = len(stack.code_clusterings)
+
+        # Clusters of each bait in selected clusterings: (bait, cluster, first
+        # entry of bait in cluster)
+        bait_rows = matrix.get_rows(baits)
+        sorted_rows = rows[stack.entry_order]
+        left = np.searchsorted(sorted_rows, bait_rows, side='left')
+        counts = np.searchsorted(sorted_rows, bait_rows, side='right') - left
+        pair_baits = np.repeat(np.arange(len(baits)), counts)
+        pair_entries = stack.entry_order[_concatenate_ranges(left, counts)]
+        in_selected = selected[stack.code_clusterings[codes[pair_entries]]]
+        pair_baits = pair_baits[in_selected]
+        pair_entries = pair_entries[in_selected]
+        is_bait = np.zeros(len(rows), dtype=bool)
+        is_bait[pair_entries] = True
+        _, first = np.unique(pair_baits * code_count + codes[pair_entries], return_index=True)
+        pair_baits = pair_baits[first]
+        pair_entries = pair_entries[first]
+        pair_codes = codes[pair_entries]
+        cluster_bait_counts = np.bincount(pair_codes, minlength=code_count)
+
+        # Expand each pair to the entries of its cluster
+        starts = np.searchsorted(codes, np.arange(code_count))
+        sizes = np.searchsorted(codes, np.arange(code_count), side='right') - starts
+        expanded_pairs = np.repeat(np.arange(len(pair_baits)), sizes[pair_codes])
+        expanded_entries = _concatenate_ranges(starts[pair_codes], sizes[pair_codes])
+        expanded_correlations = correlations[rows[expanded_entries], pair_baits[expanded_pairs]]
+
+        # Score each entry by the sum of its correlations to the baits of its
+        # cluster, normalised within the cluster. Entries of clusters without
+        # baits and baits are not ranked.
+        pre_ranking = np.bincount(expanded_entries, weights=expanded_correlations, minlength=len(rows))
+        ranked = ~is_bait & (cluster_bait_counts[codes] > 0)
+        scores = np.full(len(rows), np.nan)
+        scores[ranked] = _normalise(pre_ranking[ranked], codes[ranked])
+
+        # Leave out each bait of each cluster. Instead of rebuilding the
+        # cluster's ranking without the bait, the mean and standard deviation
+        # of its scores are derived from the pre-ranking. The normalisation
+        # preserves order, so genes of the cluster are compared before
+        # normalising.
+        pre_scores = pre_ranking[expanded_entries] - expanded_correlations
+        non_bait = ~is_bait[expanded_entries]
+        bait_pre_scores = pre_ranking[pair_entries] - correlations[rows[pair_entries], pair_baits]
+        def sum_non_bait(values):
+            return np.bincount(expanded_pairs, weights=np.where(non_bait, values, 0), minlength=len(pair_baits))
+        gene_counts = sum_non_bait(1) + 1
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = (sum_non_bait(pre_scores) + bait_pre_scores) / gene_counts
+            variance = (sum_non_bait((pre_scores - mean[expanded_pairs]) ** 2) + (bait_pre_scores - mean) ** 2) / gene_counts
+            bait_scores = (bait_pre_scores - mean) / np.sqrt(variance)
+        bait_scores[cluster_bait_counts[pair_codes] == 1] = np.nan  # cluster has no baits left
+        bait_scores[~np.isfinite(bait_scores)] = np.nan
+        better_in_cluster = sum_non_bait(pre_scores > bait_pre_scores[expanded_pairs])
+
+        # Genes of its own cluster which rank better than the bait without
+        # leaving it out, to subtract from the genes of the whole clustering
+        # which do
+        with np.errstate(invalid='ignore'):
+            better_before = np.bincount(
+                expanded_pairs,
+                weights=scores[expanded_entries] > bait_scores[expanded_pairs],
+                minlength=len(pair_baits)
+            )
+
+        self._genes = matrix.genes
+        self._rows = rows
+        self._bounds = stack.bounds
+        self._scores = scores
+        self._ranked = ranked
+        self._pair_clusterings = stack.code_clusterings[pair_codes]
+        self._bait_scores = bait_scores
+        self._better_in_cluster = better_in_cluster
+        self._better_before = better_before
+
+    def get_max_ausr(self, i):
+        '''
+        Get an upper bound on the AUSR of a clustering.
+
+        Only counts the genes of the bait's own cluster which rank better than
+        a left out bait, which is cheap as they are already counted.
+
+        Parameters
+        ----------
+        i : int
+            Index of a selected clustering in the stack.
+
+        Returns
+        -------
+        float
+        '''
+        in_clustering = self._pair_clusterings == i
+        return _get_auc(pd.Series(self._get_positions(in_clustering, self._better_in_cluster[in_clustering])))
+
+    def get_ausr(self, i):
+        '''
+        Get the AUSR of a clustering.
+
+        Parameters
+        ----------
+        i : int
+            Index of a selected clustering in the stack.
+
+        Returns
+        -------
+        float
+        '''
+        return _get_auc(pd.Series(self.get_positions(i)))
+
+    def get_positions(self, i):
+        '''
+        Get the position of each left out bait of a clustering.
+
+        Parameters
+        ----------
+        i : int
+            Index of a selected clustering in the stack.
+
+        Returns
+        -------
+        ~numpy.ndarray
+            0-based position of each bait in its ranking, best first, once per
+            cluster the bait is in. ``inf`` if the bait would not be ranked.
+        '''
+        in_clustering = self._pair_clusterings == i
+        scores, ranked = self._get_clustering_scores(i)
+        better_elsewhere = (
+            _count_greater(np.sort(scores[ranked & ~np.isnan(scores)]), self._bait_scores[in_clustering])
+            - self._better_before[in_clustering]
+        )
+        better = self._better_in_cluster[in_clustering] + better_elsewhere
+        return self._get_positions(in_clustering, better)
+
+    def top(self, i, k):
+        '''
+        Get the k best ranked genes of a clustering.
+
+        Only the top k genes are selected, without sorting the whole ranking.
+
+        Parameters
+        ----------
+        i : int
+            Index of a selected clustering in the stack.
+        k : int
+
+        Returns
+        -------
+        ~pandas.Series
+            Normalised scores sorted from best to worst, with gene ids as
+            index.
+        '''
+        scores, ranked = self._get_clustering_scores(i)
+        ranked_scores = scores[ranked]
+        top = _top_k(ranked_scores, k)
+        top_rows = self._rows[self._bounds[i]:self._bounds[i+1]][ranked][top]
+        return pd.Series(ranked_scores[top], index=self._genes[top_rows])
+
+    def _get_clustering_scores(self, i):
+        clustering = slice(self._bounds[i], self._bounds[i+1])
+        return self._scores[clustering], self._ranked[clustering]
+
+    def _get_positions(self, in_clustering, better):
+        positions = better.astype(float)
+        positions[np.isnan(self._bait_scores[in_clustering])] = np.inf  # bait would not be ranked
+        return positions
+
+def _get_entries(matrix, clustering):
+    '''
+    Get the entries of a clustering whose gene is in the matrix.
+
+    Returns
+    -------
+    ~typing.Tuple[~numpy.ndarray, ~numpy.ndarray]
+        Row in matrix and cluster code of each entry, sorted by cluster code.
+    '''
+    rows = matrix.get_rows(clustering.genes)
+    in_matrix = rows != -1
+    codes = clustering.codes[in_matrix]
+    rows = rows[in_matrix]
+    order = np.argsort(codes, kind='stable')
+    return rows[order], codes[order]
+
+def _count_greater(sorted_values, values):
+    '''
+    Count values greater than each of values in ascending sorted array.
+    '''
+    return len(sorted_values) - np.searchsorted(sorted_values, values, side='right')
+
+def _normalise(scores, codes):
+    '''
+    Normalise scores within each cluster to mean 0 and standard deviation 1.
+
+    Parameters
+    ----------
+    scores : ~numpy.ndarray
+    codes : ~numpy.ndarray
+        Cluster code of each score.
+
+    Returns
+    -------
+    ~numpy.ndarray
+        Normalised scores, NaN where the standard deviation of the cluster is 0.
+    '''
+    counts = np.bincount(codes)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        means = np.bincount(codes, weights=scores) / counts
+        deviations = scores - means[codes]
+        stds = np.sqrt(np.bincount(codes, weights=deviations ** 2) / counts)
+        return deviations / stds[codes]
+
+def _top_k(scores, k):
+    '''
+    Get indices of the k highest scores, from high to low, ignoring NaN.
+    '''
+    scores = -scores  # NaN remains NaN and is partitioned/sorted last
+    if k < len(scores):
+        top = np.argpartition(scores, k)[:k]
+    else:
+        top = np.arange(len(scores))
+    top = top[np.argsort(scores[top], kind='stable')]
+    return top[~np.isnan(scores[top])]
+
+def _get_permutation_rng(seed, baits):
+    '''
+    Get random number generator of the permutations of a combination.
+
+    Seeded by seed and the baits of the bait group after gene mapping, so
+    p-values do not depend on the order in which combinations are run, e.g.
+    with multiple jobs, nor on names, which are not part of the result store
+    key.
+
+    Parameters
+    ----------
+    seed : int
+    baits : ~typing.Iterable[str]
+        Sorted baits.
+    '''
+    key = json.dumps([seed, list(baits)])
+    return np.random.RandomState(int(hashlib.sha1(key.encode()).hexdigest()[:8], 16))
+
+def _get_p_value(matrix, clustering, bait_count, ausr, permutations, rng):
+    '''
+    Get empirical p-value of an AUSR by bait set permutation.
+
+    Random bait sets of bait_count genes are drawn from the genes in both
+    matrix and clustering. The p-value is ``(1 + hits) / (1 + permutations)``
+    where hits is the number of random bait sets with an AUSR of at least ausr.
+    Bait sets are evaluated in batches, see _get_ausrs.
+
+    Parameters
+    ----------
+    matrix : _StandardisedMatrix
+    clustering : _Clustering
+    bait_count : int
+        Number of baits of the observed bait set.
+    ausr : float
+        AUSR of the observed bait set.
+    permutations : int
+        Number of random bait sets.
+    rng : ~numpy.random.RandomState
+
+    Returns
+    -------
+    float
+    '''
+    rows, codes = _get_entries(matrix, clustering)
+    genes = np.unique(matrix.genes[rows])
+    # Per random bait, _get_ausrs holds its correlations with all genes of the
+    # matrix and about 3 arrays of them gathered per entry of the clustering
+    bait_size = 8 * (len(matrix.values) + 3 * len(rows))
+    batch_size = max(1, _PERMUTATION_BATCH_SIZE // (bait_size * bait_count))
+    hits = 0
+    for start in range(0, permutations, batch_size):
+        size = min(batch_size, permutations - start)
+        bait_sets = genes[np.argpartition(rng.rand(size, len(genes)), bait_count - 1, axis=1)[:, :bait_count]]
+        hits += int((_get_ausrs(matrix, rows, codes, bait_sets) >= ausr).sum())
+    return (1 + hits) / (1 + permutations)
+
+def _get_ausrs(matrix, rows, codes, bait_sets):
+    '''
+    Get the AUSR of each of a batch of bait sets.
+
+    Equivalent to the AUSR of _StackRanking for each bait set, but all bait
+    sets are correlated in a single matrix product and ranked and left out
+    together with array operations over the shared cluster structure.
+
+    Parameters
+    ----------
+    matrix : _StandardisedMatrix
+    rows : ~numpy.ndarray
+        Row in matrix of each entry of the clustering, see _get_entries.
+    codes : ~numpy.ndarray
+        Cluster code of each entry, sorted.
+    bait_sets : ~numpy.ndarray
+        Gene ids of the baits of each bait set, one set per row. Each bait
+        must be in both matrix and clustering.
+
+    Returns
+    -------
+    ~numpy.ndarray
+        AUSR of each bait set.
+    '''
+    set_count, bait_count = bait_sets.shape
+    baits = bait_sets.ravel()  # set * bait_count + index in set -> bait
+    bait_sets_ = np.repeat(np.arange(set_count), bait_count)  # bait -> set
+    correlations = matrix.correlate(baits)[rows]  # entries x baits
+
+    # Clusters of each bait: (bait, cluster, first entry of bait in cluster)
+    entry_order = np.argsort(rows, kind='stable')
+    bait_rows = matrix.get_rows(baits)
+    left = np.searchsorted(rows[entry_order], bait_rows, side='left')
+    counts = np.searchsorted(rows[entry_order], bait_rows, side='right') - left
+    pair_baits = np.repeat(np.arange(len(baits)), counts)
+    pair_entries = entry_order[_concatenate_ranges(left, counts)]
+    cluster_count = codes.max() + 1
+    _, first = np.unique(pair_baits * cluster_count + codes[pair_entries], return_index=True)
+    is_bait = np.zeros((len(rows), set_count), dtype=bool)
+    is_bait[pair_entries, bait_sets_[pair_baits]] = True
+    pair_baits = pair_baits[first]
+    pair_entries = pair_entries[first]
+    pair_sets = bait_sets_[pair_baits]
+    cluster_baits = np.zeros((cluster_count, len(baits)), dtype=bool)
+    cluster_baits[codes[pair_entries], pair_baits] = True
+    cluster_bait_counts = cluster_baits.reshape(cluster_count, set_count, bait_count).sum(axis=2)
+
+    # Score each entry for each set, normalised within each cluster. Entries
+    # of clusters without baits of the set and baits of the set are not
+    # ranked.
+    pre_ranking = (
+        np.where(cluster_baits[codes], correlations, 0)
+        .reshape(len(rows), set_count, bait_count)
+        .sum(axis=2)
+    )
+    ranked = ~is_bait & (cluster_bait_counts[codes] > 0)
+    starts = np.flatnonzero(np.r_[True, np.diff(codes) != 0])
+    sizes = np.diff(np.r_[starts, len(codes)])
+    clusters = np.repeat(np.arange(len(starts)), sizes)  # entry -> index of cluster in starts
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ranked_counts = np.add.reduceat(ranked, starts, axis=0)
+        means = np.add.reduceat(np.where(ranked, pre_ranking, 0), starts, axis=0) / ranked_counts
+        deviations = pre_ranking - means[clusters]
+        stds = np.sqrt(np.add.reduceat(np.where(ranked, deviations ** 2, 0), starts, axis=0) / ranked_counts)
+        scores = deviations / stds[clusters]
+    scores[~ranked] = np.nan
+
+    # Leave out each bait of each cluster, as _StackRanking, with all genes
+    # of the pair's cluster expanded per pair
+    pair_clusters = clusters[pair_entries]
+    expanded_pairs = np.repeat(np.arange(len(pair_baits)), sizes[pair_clusters])
+    expanded_entries = _concatenate_ranges(starts[pair_clusters], sizes[pair_clusters])
+    expanded_sets = pair_sets[expanded_pairs]
+    pre_scores = pre_ranking[expanded_entries, expanded_sets] - correlations[expanded_entries, pair_baits[expanded_pairs]]
+    non_bait = ~is_bait[expanded_entries, expanded_sets]
+    bait_pre_scores = pre_ranking[pair_entries, pair_sets] - correlations[pair_entries, pair_baits]
+    def sum_non_bait(values):
+        return np.bincount(expanded_pairs, weights=np.where(non_bait, values, 0), minlength=len(pair_baits))
+    gene_counts = sum_non_bait(1) + 1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = (sum_non_bait(pre_scores) + bait_pre_scores) / gene_counts
+        variance = (sum_non_bait((pre_scores - mean[expanded_pairs]) ** 2) + (bait_pre_scores - mean) ** 2) / gene_counts
+        bait_scores = (bait_pre_scores - mean) / np.sqrt(variance)
+    bait_scores[cluster_bait_counts[codes[pair_entries], pair_sets] == 1] = np.nan  # cluster has no baits left
+    bait_scores[~np.isfinite(bait_scores)] = np.nan
+    better_in_cluster = sum_non_bait(pre_scores > bait_pre_scores[expanded_pairs])
+
+    # Genes of other clusters with a better score
+    with np.errstate(invalid='ignore'):
+        better_elsewhere = -np.bincount(
+            expanded_pairs,
+            weights=scores[expanded_entries, expanded_sets] > bait_scores[expanded_pairs],
+            minlength=len(pair_baits)
+        )
+    for set_ in range(set_count):
+        set_scores = scores[:, set_]
+        in_set = pair_sets == set_
+        better_elsewhere[in_set] += _count_greater(np.sort(set_scores[~np.isnan(set_scores)]), bait_scores[in_set])
+
+    positions = better_elsewhere + better_in_cluster
+    positions[np.isnan(bait_scores)] = np.inf
+    areas = np.where(positions < 1000, 1000 - positions, 0)
+    return np.bincount(pair_sets, weights=areas, minlength=set_count) / (1000 * np.bincount(pair_sets, minlength=set_count))
+
+def _concatenate_ranges(starts, lengths):
+    '''
+    Concatenate ``np.arange(start, start + length)`` of each start and length.
+    '''
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return offsets + np.arange(lengths.sum())
 
 def _get_auc(indices):
+    '''
+    Get area under the self-rank curve (AUSR).
+
+    Parameters
+    ----------
+    indices : ~pandas.Series
+        0-based position of each left out bait in its ranking, best first.
+        ``inf`` if the bait was not ranked.
+    '''
     # TODO warn if there are fewer than 1000?
-    return indices[indices < 1000].sum() / (1000 * len(indices))
+    return (1000 - indices[indices < 1000]).sum() / (1000 * len(indices))
 
 def _tidy_grouped_bait_groups(config):
     _logger.debug('Tidying bait groups')
@@ -237,32 +1812,112 @@ def _tidy_grouped_bait_groups(config):
     }
 
 def _tidy_bait_groups(config, species_name, bait_groups):
-    def parse_gene_mapping_or_default():
-        if gene_mapping_path:
-            with gene_mapping_path.read() as f:
-                return yaml.load(f)
-        else:
-            return {}
-
-    def drop_duplicates_and_map_names(gene_mapping):
-        def map_genes(genes):
-            return {
-                mapped_gene
-                for gene in genes
-                for mapped_gene in gene_mapping.get(gene, (gene,))
-            }
-        def map_group(group):
-            group = group.copy()
-            group['genes'] = map_genes(group['genes'])
-            return group
-        return {
-            group_id: map_group(group)
-            for group_id, group in bait_groups.items()
-        }
+    return _map_bait_groups(bait_groups, _get_gene_mapping(config, species_name))
 
+def _get_gene_mapping(config, species_name):
+    '''
+    Get gene mapping of species, empty if it has none.
+
+    The mapping is cached as arrays in cache_dir, so later runs need not parse
+    its YAML file again.
+
+    Returns
+    -------
+    _GeneMapping
+    '''
     gene_mapping_path = config['species'][species_name].get('gene_mapping')
-    gene_mapping = parse_gene_mapping_or_default(gene_mapping_path)
-    return drop_duplicates_and_map_names(gene_mapping)
+    if gene_mapping_path:
+        arrays = cache.load(
+            _get_cache_dir(config), gene_mapping_path, 'gene_mapping',
+            partial(_read_gene_mapping, gene_mapping_path)
+        )
+        return _GeneMapping(**arrays)
+    else:
+        return _GeneMapping.from_dict({})
+
+def _read_gene_mapping(path):
+    _logger.info('Reading gene mapping {}'.format(path))
+    with open(path) as f:
+        gene_mapping = yaml.load(f, Loader=_YamlLoader)
+    return _GeneMapping.from_dict(gene_mapping or {}).to_arrays()
+
+class _GeneMapping:
+
+    '''
+    Mapping of genes to their canonical names, as sorted arrays.
+
+    Parameters
+    ----------
+    sources : ~numpy.ndarray
+        Sorted names of the mapped genes, as str array.
+    offsets : ~numpy.ndarray
+        ``targets[offsets[i]:offsets[i+1]]`` are the canonical names of
+        ``sources[i]``.
+    targets : ~numpy.ndarray
+        Canonical names, as str array.
+    '''
+
+    def __init__(self, sources, offsets, targets):
+        self._sources = sources
+        self._offsets = offsets
+        self._targets = targets
+
+    @classmethod
+    def from_dict(cls, gene_mapping):
+        '''
+        Create from dict of canonical names by gene.
+        '''
+        sources = sorted(gene_mapping, key=str)
+        targets = [list(gene_mapping[source]) for source in sources]
+        return cls(
+            sources=np.array([str(source) for source in sources], dtype=str),
+            offsets=np.cumsum([0] + [len(targets_) for targets_ in targets]),
+            targets=np.array([str(target) for targets_ in targets for target in targets_], dtype=str),
+        )
+
+    def to_arrays(self):
+        '''
+        Get arrays, see morphbio.cache.load.
+        '''
+        return {'sources': self._sources, 'offsets': self._offsets, 'targets': self._targets}
+
+    def map(self, genes):
+        '''
+        Map genes to their canonical names.
+
+        Parameters
+        ----------
+        genes : ~typing.Iterable[str]
+
+        Returns
+        -------
+        ~typing.Set[str]
+            Canonical names of the genes. Genes not in the mapping map to
+            themselves.
+        '''
+        genes = list(genes)
+        if not genes or not len(self._sources):
+            return set(genes)
+        names = np.array([str(gene) for gene in genes], dtype=str)
+        positions = np.searchsorted(self._sources, names).clip(max=len(self._sources) - 1)
+        found = self._sources[positions] == names
+        mapped_genes = {gene for gene, found_ in zip(genes, found) if not found_}
+        for position in positions[found]:
+            mapped_genes.update(self._targets[self._offsets[position]:self._offsets[position + 1]].tolist())
+        return mapped_genes
+
+def _map_bait_groups(bait_groups, gene_mapping):
+    '''
+    Map the genes of bait groups to their canonical names, dropping duplicates.
+    '''
+    def map_group(group):
+        group = group.copy()
+        group['genes'] = gene_mapping.map(group['genes'])
+        return group
+    return {
+        group_id: map_group(group)
+        for group_id, group in bait_groups.items()
+    }
 
 def _get_top_k(config):
     top_k = config['top_k']
@@ -270,36 +1925,250 @@ def _get_top_k(config):
         raise ValueError('top_k must be an int >=1. Got: {!r}'.format(top_k))
     if top_k < 1:
         raise ValueError('top_k must be >=1. Got: {!r}'.format(top_k))
+    return top_k
+
+def _get_correlation_cache_size(config):
+    size = config.get('correlation_cache_size', 1024)
+    if not isinstance(size, int) or size < 0:
+        raise ValueError('correlation_cache_size must be an int >=0. Got: {!r}'.format(size))
+    return size * 2**20
+
+def _get_correlation_dtype(config):
+    dtype = config.get('correlation_dtype', 'float64')
+    if dtype not in ('float32', 'float64'):
+        raise ValueError('correlation_dtype must be float32 or float64. Got: {!r}'.format(dtype))
+    return np.dtype(dtype)
+
+def _get_batch_correlations(config):
+    batch_correlations = config.get('batch_correlations', False)
+    if not isinstance(batch_correlations, bool):
+        raise ValueError('batch_correlations must be a bool. Got: {!r}'.format(batch_correlations))
+    return batch_correlations
+
+def _get_matrix_block_size(config):
+    block_size = config.get('matrix_block_size')
+    if block_size is None:
+        return None
+    if not isinstance(block_size, int) or block_size < 1:
+        raise ValueError('matrix_block_size must be an int >=1. Got: {!r}'.format(block_size))
+    if config.get('cache_dir') is None:
+        raise ValueError('matrix_block_size requires cache_dir to be set')
+    return block_size * 2**20
+
+def _get_permutations(config):
+    permutations = config.get('permutations', 0)
+    if not isinstance(permutations, int) or permutations < 0:
+        raise ValueError('permutations must be an int >=0. Got: {!r}'.format(permutations))
+    return permutations
+
+def _get_permutation_seed(config):
+    seed = config.get('permutation_seed', 0)
+    if not isinstance(seed, int) or seed < 0:
+        raise ValueError('permutation_seed must be an int >=0. Got: {!r}'.format(seed))
+    return seed
+
+def _get_cache_dir(config):
+    cache_dir = config.get('cache_dir')
+    if cache_dir is None:
+        return None
+    cache_dir = Path(cache_dir)
+    if not cache_dir.is_absolute():
+        raise ValueError('cache_dir must be an absolute path. Got: {!r}'.format(str(cache_dir)))
+    return cache_dir
+
+def _get_result_store(config):
+    store_dir = config.get('result_store')
+    if store_dir is None:
+        return None
+    store_dir = Path(store_dir)
+    if not store_dir.is_absolute():
+        raise ValueError('result_store must be an absolute path. Got: {!r}'.format(str(store_dir)))
+    return store_dir
+
+class _GeneTable:
+
+    '''
+    Run-wide table of gene names interned as int32 ids.
+
+    Internally, genes are referred to by id, so lookups and set operations on
+    genes index arrays by id instead of hashing names. Names are restored only
+    for results. Ids are only meaningful to the table they are from; each
+    process has its own table.
+    '''
+
+    def __init__(self):
+        self._ids = {}  # name -> id
+        self._names = []  # id -> name
+        self._lock = threading.Lock()  # matrices are loaded in a background thread
+
+    def intern(self, names):
+        '''
+        Get id of each gene, adding genes not yet in the table.
+
+        Parameters
+        ----------
+        names : ~typing.Iterable[str]
+
+        Returns
+        -------
+        ~numpy.ndarray
+            Gene ids as int32.
+        '''
+        ids = []
+        with self._lock:
+            for name in names:
+                id_ = self._ids.get(name)
+                if id_ is None:
+                    id_ = self._ids[name] = len(self._names)
+                    self._names.append(str(name))
+                ids.append(id_)
+        return np.array(ids, dtype=np.int32)
+
+    def lookup(self, names):
+        '''
+        Get id of each gene, without adding genes to the table.
+
+        Parameters
+        ----------
+        names : ~typing.Iterable[str]
+
+        Returns
+        -------
+        ~numpy.ndarray
+            Gene ids as int32, -1 for genes not in the table. As matrices and
+            clusterings add their genes, these are in neither.
+        '''
+        with self._lock:
+            return np.array([self._ids.get(name, -1) for name in names], dtype=np.int32)
+
+    def names(self, ids):
+        '''
+        Get name of each gene.
+
+        Parameters
+        ----------
+        ids : ~typing.Iterable[int]
+
+        Returns
+        -------
+        ~pandas.Index
+            Gene names.
+        '''
+        return pd.Index([self._names[id_] for id_ in ids], dtype=object)
+
+class _Clustering:
 
-def _parse_clusterings(clusterings):
     '''
-    Parse clustering files.
+    Clustering of genes, as arrays.
 
     Parameters
     ----------
-    clusterings : ~typing.Mapping[str, str]
-        Mapping of clustering names to paths.
+    genes : ~numpy.ndarray
+        Gene id of each entry, see _GeneTable.
+    codes : ~numpy.ndarray
+        Cluster code of each entry. Each entry is a gene in a cluster, a gene
+        may be in multiple clusters.
 
-    Returns
-    -------
-    ~typing.Mapping[str, ~pandas.Series]
-        Mapping of clustering names to clustering series. Each series has gene
-        names as index, cluster names as values and ``cluster`` as series name.
+    Attributes
+    ----------
+    genes : ~numpy.ndarray
+    codes : ~numpy.ndarray
     '''
-    return {
-        name: _parse_clustering(path)
-        for name, path in clusterings.items()
-    }
+
+    def __init__(self, genes, codes):
+        self.genes = genes
+        self.codes = codes
+        self._unique_genes = np.unique(genes)
+
+    def contains(self, genes):
+        '''
+        Get whether each gene is in a cluster of the clustering.
+
+        Parameters
+        ----------
+        genes : ~numpy.ndarray
+            Gene ids.
+
+        Returns
+        -------
+        ~numpy.ndarray
+            Bool array.
+        '''
+        return np.isin(genes, self._unique_genes)
+
+class _ClusteringRegistry:
+
+    '''
+    Clusterings of a run, each file parsed at most once.
+
+    Parameters
+    ----------
+    cache_dir : ~pathlib.Path or None
+        Cache directory, see morphbio.cache.load.
+    gene_table : _GeneTable
+        Table to intern the genes of clusterings in.
+    '''
+
+    def __init__(self, cache_dir, gene_table):
+        self._cache_dir = cache_dir
+        self._gene_table = gene_table
+        self._clusterings = {}  # resolved path -> clustering
+
+    def get_all(self, clusterings):
+        '''
+        Get clusterings by name.
+
+        Parameters
+        ----------
+        clusterings : ~typing.Mapping[str, str]
+            Mapping of clustering names to paths.
+
+        Returns
+        -------
+        ~typing.Mapping[str, _Clustering]
+            Mapping of clustering names to clusterings, see `get`.
+        '''
+        return {
+            name: self.get(path)
+            for name, path in clusterings.items()
+        }
+
+    def get(self, path):
+        '''
+        Get clustering.
+
+        Parameters
+        ----------
+        path : str
+            Path to clustering file.
+
+        Returns
+        -------
+        _Clustering
+        '''
+        path = str(Path(path).resolve())
+        if path not in self._clusterings:
+            arrays = cache.load(self._cache_dir, path, 'clustering', partial(_parse_clustering, path))
+            self._clusterings[path] = _Clustering(self._gene_table.intern(arrays['genes']), arrays['codes'])
+        return self._clusterings[path]
 
 def _parse_clustering(path):
+    '''
+    Parse clustering file.
+
+    Returns
+    -------
+    ~typing.Dict[str, ~numpy.ndarray]
+        ``genes``, ``codes`` and ``clusters`` such that the i-th gene is in
+        cluster ``clusters[codes[i]]``.
+    '''
     with open(path) as f:
         clustering = parse.clustering(clean.plain_text(f))
-        df = pd.DataFrame(
-            (
-                (gene, cluster_name)
-                for cluster_name, cluster in clustering.items()
-                for gene in cluster
-            ),
-            columns=('gene', 'cluster')
-        )
-        return df.set_index('gene')['cluster']
+    clusters = list(clustering.keys())
+    genes = [gene for cluster in clustering.values() for gene in cluster]
+    sizes = [len(cluster) for cluster in clustering.values()]
+    return {
+        'genes': np.array(genes, dtype=str),
+        'codes': np.repeat(np.arange(len(clusters), dtype=np.int32), sizes),
+        'clusters': np.array(clusters, dtype=str),
+    }
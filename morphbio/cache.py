@@ -0,0 +1,127 @@
+# Copyright (C) 2018 VIB/BEG/UGent - Tim Diels <timdiels.m@gmail.com>
+#
+# This file is part of MORPH.
+#
+# MORPH is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MORPH is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with MORPH.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Binary cache of data derived from input files
+'''
+
+from pathlib import Path
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+
+_logger = logging.getLogger(__name__)
+
+def load(cache_dir, source, variant, create):
+    '''
+    Load arrays derived from a source file, creating and caching them if needed.
+
+    Cached arrays are stored as ``.npy`` files and memory-mapped when loaded, so
+    loading is near-instant and processes loading the same arrays share their
+    pages.
+
+    Parameters
+    ----------
+    cache_dir : ~pathlib.Path or None
+        Directory to cache in. If `None`, the arrays are created without
+        caching.
+    source : str
+        Path to the file the arrays are derived from. The cache entry is
+        recreated when the size or modification time of the file changes.
+    variant : str
+        Name of the derivation, e.g. to cache a matrix as float32 and float64
+        separately.
+    create : ~typing.Callable[[], ~typing.Mapping[str, ~numpy.ndarray or ~pathlib.Path]]
+        Create the arrays from the source. Arrays may not be of object dtype.
+        Instead of an array, the path of a ``.npy`` file in cache_dir may be
+        returned, e.g. for arrays too large for memory. The file is moved
+        into the cache.
+
+    Returns
+    -------
+    ~typing.Mapping[str, ~numpy.ndarray]
+        Arrays by name. Cached arrays are read-only.
+    '''
+    if cache_dir is None:
+        return create()
+
+    source = Path(source).resolve()
+    stat = source.stat()
+    meta = {
+        'source': str(source),
+        'variant': variant,
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+    }
+    key = hashlib.sha1('{}\0{}'.format(source, variant).encode()).hexdigest()
+    entry_dir = Path(cache_dir) / key
+
+    # Load if up to date
+    arrays = _load_entry(entry_dir, meta)
+    if arrays is not None:
+        _logger.debug('Loaded {} of {} from cache'.format(variant, source))
+        return arrays
+
+    # Create and cache. Written to a temporary directory first and then moved
+    # in place, so other processes never see a partially written entry.
+    _logger.info('Caching {} of {} in {}'.format(variant, source, entry_dir))
+    arrays = create()
+    Path(cache_dir).mkdir(parents=True, exist_ok=True)
+    tmp_dir = Path(tempfile.mkdtemp(dir=str(cache_dir), prefix='.tmp'))
+    try:
+        for name, array in arrays.items():
+            path = tmp_dir / '{}.npy'.format(name)
+            if isinstance(array, Path):
+                os.replace(str(array), str(path))
+            else:
+                np.save(str(path), array, allow_pickle=False)
+        (tmp_dir / 'meta.json').write_text(json.dumps(dict(meta, arrays=sorted(arrays))))
+        if entry_dir.exists():
+            shutil.rmtree(str(entry_dir), ignore_errors=True)
+        try:
+            os.rename(str(tmp_dir), str(entry_dir))
+        except OSError:
+            pass  # another process cached it concurrently
+    finally:
+        shutil.rmtree(str(tmp_dir), ignore_errors=True)
+
+    return _load_entry(entry_dir, meta) or arrays
+
+def _load_entry(entry_dir, meta):
+    '''
+    Load memory-mapped arrays of cache entry, or `None` if missing or outdated.
+    '''
+    try:
+        cached_meta = json.loads((entry_dir / 'meta.json').read_text())
+    except (OSError, ValueError):
+        return None
+    names = cached_meta.pop('arrays', [])
+    if cached_meta != meta:
+        return None
+    try:
+        return {
+            name: np.load(str(entry_dir / '{}.npy'.format(name)), mmap_mode='r', allow_pickle=False)
+            for name in names
+        }
+    except (OSError, ValueError):
+        return None
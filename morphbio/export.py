@@ -0,0 +1,169 @@
+# Copyright (C) 2018 VIB/BEG/UGent - Tim Diels <timdiels.m@gmail.com>
+#
+# This file is part of MORPH.
+#
+# MORPH is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MORPH is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with MORPH.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Columnar export of all results, in Arrow IPC format
+
+Requires the optional dependency pyarrow, ``pip install morphbio[arrow]``.
+'''
+
+from pathlib import Path
+import logging
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+
+_logger = logging.getLogger(__name__)
+
+class ArrowWriter:
+
+    '''
+    Write results to Arrow IPC files, in batches.
+
+    Writes 2 files to the output directory:
+
+    ``results.arrow``
+        A row per result with columns ``bait_group_id``, ``bait_group_name``,
+        ``matrix_name``, ``clustering_name``, ``ausr``, ``p_value``,
+        ``present_baits`` and ``missing_baits`` (counts) and ``skip_reason``.
+        ``ausr``, ``p_value`` and ``skip_reason`` are null where not
+        applicable.
+
+    ``rankings.arrow``
+        The rankings in long format, a row per ranked gene with columns
+        ``bait_group_id``, ``matrix_name``, ``clustering_name``, ``rank``
+        (1-based), ``gene`` and ``score``.
+
+    Each batch of results is written as a record batch, so memory use does not
+    grow with the number of results. The files can be memory-mapped and read
+    without copying, e.g.
+    ``pyarrow.ipc.open_file(pyarrow.memory_map('results.arrow')).read_all()``.
+
+    Parameters
+    ----------
+    output_dir : ~pathlib.Path
+        Directory to write to.
+    batch_size : int
+        Number of results per record batch.
+
+    Raises
+    ------
+    ImportError
+        If pyarrow is not installed.
+    '''
+
+    def __init__(self, output_dir, batch_size=1024):
+        if pa is None:
+            raise ImportError('Arrow export requires pyarrow, install morphbio[arrow]')
+        output_dir = Path(output_dir)
+        self._batch_size = batch_size
+        self._results = []
+        self._files = []
+        self._results_writer = self._open(output_dir / 'results.arrow', _get_results_schema())
+        self._rankings_writer = self._open(output_dir / 'rankings.arrow', _get_rankings_schema())
+
+    def add(self, result):
+        '''
+        Add result.
+
+        Parameters
+        ----------
+        result : morphbio.algorithm.Result
+        '''
+        self._results.append(result)
+        if len(self._results) >= self._batch_size:
+            self._flush()
+
+    def close(self):
+        '''
+        Write remaining results and close the files.
+        '''
+        self._flush()
+        for writer in (self._results_writer, self._rankings_writer):
+            writer.close()
+        for file in self._files:
+            file.close()
+
+    def _open(self, path, schema):
+        _logger.info('Writing results to {}'.format(path))
+        file = pa.OSFile(str(path), 'wb')
+        self._files.append(file)
+        return pa.RecordBatchFileWriter(file, schema)
+
+    def _flush(self):
+        if not self._results:
+            return
+        results = self._results
+        self._results = []
+
+        self._results_writer.write_batch(_to_batch(_get_results_schema(), [
+            [result.bait_group_id for result in results],
+            [result.bait_group_name for result in results],
+            [result.matrix_name for result in results],
+            [result.clustering_name for result in results],
+            [None if result.ausr is None else float(result.ausr) for result in results],
+            [None if result.p_value is None else float(result.p_value) for result in results],
+            [len(result.present_baits) for result in results],
+            [len(result.missing_baits) for result in results],
+            [result.skip_reason for result in results],
+        ]))
+
+        columns = [[] for _ in range(6)]
+        for result in results:
+            if result.ranking is None:
+                continue
+            size = len(result.ranking)
+            columns[0].extend([result.bait_group_id] * size)
+            columns[1].extend([result.matrix_name] * size)
+            columns[2].extend([result.clustering_name] * size)
+            columns[3].extend(range(1, size + 1))
+            columns[4].extend(result.ranking.index.tolist())
+            columns[5].extend(result.ranking.values.tolist())
+        if columns[0]:
+            self._rankings_writer.write_batch(_to_batch(_get_rankings_schema(), columns))
+
+def _get_results_schema():
+    return pa.schema([
+        pa.field('bait_group_id', pa.string()),
+        pa.field('bait_group_name', pa.string()),
+        pa.field('matrix_name', pa.string()),
+        pa.field('clustering_name', pa.string()),
+        pa.field('ausr', pa.float64()),
+        pa.field('p_value', pa.float64()),
+        pa.field('present_baits', pa.int64()),
+        pa.field('missing_baits', pa.int64()),
+        pa.field('skip_reason', pa.string()),
+    ])
+
+def _get_rankings_schema():
+    return pa.schema([
+        pa.field('bait_group_id', pa.string()),
+        pa.field('matrix_name', pa.string()),
+        pa.field('clustering_name', pa.string()),
+        pa.field('rank', pa.int32()),
+        pa.field('gene', pa.string()),
+        pa.field('score', pa.float64()),
+    ])
+
+def _to_batch(schema, columns):
+    return pa.RecordBatch.from_arrays(
+        [pa.array(column, type=field.type) for field, column in zip(schema, columns)],
+        [field.name for field in schema]
+    )
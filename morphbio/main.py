@@ -20,33 +20,47 @@ Command line interface (CLI)
 '''
 
 from pathlib import Path
+from datetime import timedelta
 from textwrap import dedent
+import cProfile
+import json
 import logging
+import re
 
 from pytil import logging as logging_
+import attr
 import click
+import numpy as np
 import pandas as pd
 import yaml
 
 from morphbio import __version__
-from morphbio.algorithm import morph
+from morphbio.algorithm import morph, plan, Result
+from morphbio.export import ArrowWriter
+from morphbio.profile import Profiler
 
 
 _logger = logging.getLogger(__name__)
 
-@click.command()
+def _parse_shard(ctx, param, value):
+    if value is None:
+        return None
+    match = re.fullmatch(r'(\d+)/(\d+)', value)
+    if not match or not 1 <= int(match.group(1)) <= int(match.group(2)):
+        raise click.BadParameter('must be i/N with 1 <= i <= N, e.g. 2/10. Got: {}'.format(value))
+    return int(match.group(1)), int(match.group(2))
+
+@click.group(invoke_without_command=True)
 @click.version_option(__version__)
 @click.option(  # For things which don't change often
     '--config', 'config_file',
-    required=True,
     type=click.Path(exists=True, dir_okay=False, resolve_path=True),
-    help='Configuration YAML file, see config.yaml in the documentation.'
+    help='Configuration YAML file, see config.yaml in the documentation. Required.'
 )
-@click.argument(  # For things which often change between runs
-    '--run_config', 'run_config_file',
-    required=True,
+@click.option(  # For things which often change between runs
+    '--run-config', 'run_config_file',
     type=click.Path(exists=True, dir_okay=False, resolve_path=True),
-    help='Run config YAML file, see run_config.yaml in the documentation.'
+    help='Run config YAML file, see run_config.yaml in the documentation. Required.'
 )
 @click.option(
     '-o', '--output', 'output_dir',
@@ -56,7 +70,78 @@ _logger = logging.getLogger(__name__)
     type=click.Path(exists=True, file_okay=False, resolve_path=True),
     help='Output directory'
 )
-def main(config_file, run_config_file, output_dir):
+@click.option(
+    '-j', '--jobs',
+    show_default=True,
+    default=1,
+    type=click.IntRange(min=1),
+    help='Number of processes to run MORPH with.'
+)
+@click.option(
+    '--ordered',
+    is_flag=True,
+    help=(
+        'With --jobs > 1, process results in the same order as with a single '
+        'job, e.g. to pick the same best ranking when AUSRs are tied.'
+    )
+)
+@click.option(
+    '--resume',
+    is_flag=True,
+    help=(
+        'Continue an interrupted run with the same output directory. '
+        'Combinations recorded in its journal.jsonl are not run again.'
+    )
+)
+@click.option(
+    '--profile',
+    is_flag=True,
+    help=(
+        'Write a cProfile dump to morph.prof in the output directory. With '
+        '--jobs > 1, only the main process is profiled.'
+    )
+)
+@click.option(
+    '--best-only',
+    is_flag=True,
+    help=(
+        'Abandon combinations which cannot exceed the best AUSR found so far '
+        'for their bait group, by an upper bound on their AUSR. Faster, but '
+        'the statistics of AUSRs of other rankings then only include the '
+        'completed combinations.'
+    )
+)
+@click.option(
+    '--shard',
+    callback=_parse_shard,
+    help=(
+        'Run only the i-th of N shards, as i/N, e.g. 2/10. The matrix and '
+        'clustering combinations are split across the shards. Instead of '
+        'rankings and overview.txt, shard.jsonl is written. Combine the '
+        'shards with `morph merge`.'
+    )
+)
+@click.option(
+    '--arrow',
+    is_flag=True,
+    help=(
+        'Also write the results of all combinations, not only the best, to '
+        'results.arrow and rankings.arrow in Arrow IPC format. Requires '
+        'pyarrow.'
+    )
+)
+@click.option(
+    '--plan', 'plan_only',
+    is_flag=True,
+    help=(
+        'Only estimate the run time and peak memory of the run, given --jobs, '
+        'without running it. Reads only the first lines of the expression '
+        'matrices and clusterings. Writes the estimate of each combination to '
+        'plan.tsv.'
+    )
+)
+@click.pass_context
+def main(ctx, config_file, run_config_file, output_dir, jobs, ordered, resume, profile, best_only, shard, arrow, plan_only):
     '''
     Run MORPH.
 
@@ -65,87 +150,492 @@ def main(config_file, run_config_file, output_dir):
     \b
         morph --config config.yaml --run-config run_config.yaml --output output
     '''
+    if ctx.invoked_subcommand is not None:
+        return
+    if config_file is None:
+        raise click.UsageError('Missing option "--config".')
+    if run_config_file is None:
+        raise click.UsageError('Missing option "--run-config".')
+    output_dir = Path(output_dir)
     logging_.configure(output_dir / 'morph.log')
+    if profile:
+        cprofile = cProfile.Profile()
+        cprofile.enable()
+    profiler = Profiler()
 
     # Parse
     _logger.info('')
     config_file = Path(config_file)
     run_config_file = Path(run_config_file)
-    output_dir = Path(output_dir)
     with config_file.open() as f:
         config = yaml.load(f)
     with run_config_file.open() as f:
         config.update(yaml.load(f))
+    if shard is not None:
+        config = _get_shard_config(config, *shard)
+    if plan_only:
+        _write_plan(output_dir / 'plan.tsv', plan(config, jobs, ordered), jobs)
+        return
 
-    # Run alg
-    results = pd.DataFrame(
-        (
-            (result.bait_group, result.ausr, result)
-            for result in morph(config)
-        ),
-        columns=('bait_group_id', 'ausr', 'result')
-    )
+    # Arrow files are rewritten from scratch, on resume starting with the
+    # results in the journal
+    arrow_writer = None
+    if arrow:
+        try:
+            arrow_writer = ArrowWriter(output_dir)
+        except ImportError as ex:
+            raise click.UsageError(str(ex))
+
+    # Run alg and write best result per bait group to output directory as soon
+    # as all its combinations are done. Each result is also appended to the
+    # journal, for --resume.
+    if shard is None:
+        rankings_dir = output_dir / 'rankings'
+        rankings_dir.mkdir(exist_ok=resume)
+        writer = _ResultWriter(rankings_dir, _get_combination_counts(config))
+    else:
+        writer = _ShardWriter(output_dir / 'shard.jsonl', shard, _get_combination_counts(config))
+    journal_file = output_dir / 'journal.jsonl'
+    done = set()
+    if resume and journal_file.exists():
+        _logger.info('Resuming from {}'.format(journal_file))
+        for result in _read_journal(journal_file):
+            with profiler.stage('write_output'):
+                writer.add(result)
+                if arrow_writer:
+                    arrow_writer.add(result)
+            done.add((result.bait_group_id, result.matrix_name, result.clustering_name))
+    with journal_file.open('a' if resume else 'w') as journal:
+        for result in morph(config, jobs, ordered, skip=done, profiler=profiler, best_only=best_only):
+            with profiler.stage('write_output'):
+                _write_journal_entry(journal, result)
+                writer.add(result)
+                if arrow_writer:
+                    arrow_writer.add(result)
+    with profiler.stage('write_output'):
+        best_ausrs = writer.close()
+        if arrow_writer:
+            arrow_writer.close()
+        if shard is None:
+            _write_overview(output_dir / 'overview.txt', best_ausrs)
 
-    # Write best result per bait group to output directory
+    # Write profile
+    profile_file = output_dir / 'profile.json'
+    _logger.info('Writing run profile to {}'.format(profile_file))
+    with profile_file.open('w') as f:
+        json.dump(profiler.to_dict(), f, indent=2, sort_keys=True)
+    if profile:
+        cprofile.disable()
+        cprofile.dump_stats(str(output_dir / 'morph.prof'))
+
+@main.command()
+@click.option(
+    '-o', '--output', 'output_dir',
+    required=True,
+    show_default=True,
+    default='.',
+    type=click.Path(exists=True, file_okay=False, resolve_path=True),
+    help='Output directory'
+)
+@click.argument(
+    'shard_files',
+    nargs=-1,
+    required=True,
+    type=click.Path(exists=True, dir_okay=False, resolve_path=True),
+)
+def merge(output_dir, shard_files):
+    '''
+    Merge the shard.jsonl files of all shards of a run.
+
+    Writes the rankings and overview.txt the unsharded run would have
+    written. For example:
+
+    \b
+        morph merge --output output shard*/shard.jsonl
+    '''
+    output_dir = Path(output_dir)
+    logging_.configure(output_dir / 'morph.log')
+
+    # Check all shards are given once
+    shards = {}  # shard index -> shard file
+    shard_counts = set()
+    for shard_file in shard_files:
+        with open(shard_file) as f:
+            (index, count), _ = _read_shard(f)
+        if index in shards:
+            raise click.UsageError('Shard {}/{} given more than once'.format(index, count))
+        shards[index] = shard_file
+        shard_counts.add(count)
+    if len(shard_counts) > 1:
+        raise click.UsageError('Shards are of runs with a different number of shards')
+    shard_count = shard_counts.pop()
+    missing = set(range(1, shard_count + 1)) - set(shards)
+    if missing:
+        raise click.UsageError('Missing shards: {}'.format(', '.join(
+            '{}/{}'.format(index, shard_count) for index in sorted(missing)
+        )))
+
+    # Merge in shard order, so ties are resolved as in an unsharded run
     rankings_dir = output_dir / 'rankings'
     rankings_dir.mkdir()
-    for bait_group_id, group in results.groupby('bait_group_id'):
-        output_file = rankings_dir / '{}.txt'.format(bait_group_id)
-        best_index = group['ausr'].idxmax()
-        if pd.isnull(best_index):
+    writer = _ResultWriter(rankings_dir, {})
+    for index in sorted(shards):
+        _logger.info('Merging {}'.format(shards[index]))
+        with open(shards[index]) as f:
+            _, summaries = _read_shard(f)
+            for group_id, summary in summaries:
+                writer.add_summary(group_id, summary)
+    _write_overview(output_dir / 'overview.txt', writer.close())
+
+def _write_plan(plan_file, plan_, jobs):
+    _logger.info('Writing plan to {}'.format(plan_file))
+    plan_.combinations.to_csv(str(plan_file), sep='\t', index=False)
+    most_expensive = plan_.combinations.nlargest(10, 'seconds')
+    click.echo(dedent('''
+        Combinations: {}
+        Estimated run time with {} job(s): {}
+        Estimated peak memory: {:.1f} MiB
+
+        Most expensive combinations:
+        {}
+
+        Estimate per combination written to {}
+        ''').strip().format(
+            len(plan_.combinations),
+            jobs,
+            timedelta(seconds=round(plan_.seconds)),
+            plan_.memory / 2**20,
+            most_expensive.to_string(index=False),
+            plan_file
+        )
+    )
+
+def _get_shard_config(config, index, count):
+    '''
+    Get config of the index-th of count shards.
+
+    The matrix and clustering pairs of all species are split, in order, into
+    count contiguous parts of similar size, so that each shard loads few
+    matrices.
+
+    Parameters
+    ----------
+    config : ~typing.Dict
+    index : int
+        1-based shard index.
+    count : int
+
+    Returns
+    -------
+    ~typing.Dict
+        Config with only the matrices and clusterings of the shard.
+    '''
+    pairs = [
+        (species_name, matrix_name, clustering_name)
+        for species_name, species in config['species'].items()
+        for matrix_name, matrix_info in species['expression_matrices'].items()
+        for clustering_name in matrix_info['clusterings']
+    ]
+    shard_pairs = set(pairs[(index - 1) * len(pairs) // count:index * len(pairs) // count])
+    species_ = {}
+    for species_name, species in config['species'].items():
+        matrices = {}
+        for matrix_name, matrix_info in species['expression_matrices'].items():
+            clusterings = {
+                clustering_name: path
+                for clustering_name, path in matrix_info['clusterings'].items()
+                if (species_name, matrix_name, clustering_name) in shard_pairs
+            }
+            if clusterings:
+                matrices[matrix_name] = dict(matrix_info, clusterings=clusterings)
+        species_[species_name] = dict(species, expression_matrices=matrices)
+    return dict(config, species=species_)
+
+def _write_overview(overview_file, best_ausrs):
+    '''
+    Write overview of best AUSRs.
+    '''
+    _logger.info('Writing overview of results to {}'.format(overview_file))
+    with overview_file.open('w') as f:
+        best_ausrs.sort_values(inplace=True, ascending=False)
+        f.write(dedent('''
+            Statistics of best AUSRs:
+            {}
+            
+            List of best AUSRs:
+            {}
+            ''').strip().format(
+                best_ausrs.describe().to_string(), # TODO consider how NA affects the stats
+                best_ausrs.to_string(header=False)
+            )
+        )
+
+def _write_journal_entry(journal, result):
+    '''
+    Append result to journal as a line of JSON.
+    '''
+    journal.write(json.dumps(result.to_dict()) + '\n')
+    journal.flush()
+
+def _read_journal(journal_file):
+    '''
+    Read results from journal.
+
+    A trailing incomplete entry, e.g. of a run killed while writing it, is
+    removed from the file.
+
+    Returns
+    -------
+    ~typing.Iterable[morphbio.algorithm.Result]
+    '''
+    with journal_file.open('r+') as journal:
+        end = 0
+        for line in iter(journal.readline, ''):
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                break
+            if not line.endswith('\n'):
+                break
+            end = journal.tell()
+            yield Result.from_dict(entry)
+        journal.seek(end)
+        journal.truncate()
+
+def _get_combination_counts(config):
+    '''
+    Get number of results morph yields per bait group.
+
+    Returns
+    -------
+    ~typing.Dict[str, int]
+        Number of matrix and clustering combinations by bait group id.
+    '''
+    counts = {}
+    for species_name, bait_groups in config['bait_groups'].items():
+        matrices = config['species'][species_name]['expression_matrices'].values()
+        count = sum(len(matrix_info['clusterings']) for matrix_info in matrices)
+        for group_id in bait_groups:
+            counts[group_id] = count
+    return counts
+
+@attr.s
+class _GroupSummary:
+
+    '''
+    Summary of the results of a bait group seen so far.
+
+    Attributes
+    ----------
+    first : morphbio.algorithm.Result
+        First result of the group.
+    best : morphbio.algorithm.Result or None
+        Result with highest AUSR, or `None` if all were skipped.
+    ausrs : ~typing.List[float]
+        AUSR of each result, NaN if skipped.
+    '''
+
+    first = attr.ib()
+    best = attr.ib(default=None)
+    ausrs = attr.ib(default=attr.Factory(list))
+
+    def add(self, result):
+        '''
+        Add result of the group.
+        '''
+        if result.ausr is None:
+            self.ausrs.append(np.nan)
+        else:
+            self.ausrs.append(result.ausr)
+            if self.best is None or result.ausr > self.best.ausr:
+                self.best = result
+
+    def merge(self, other):
+        '''
+        Add results of another summary of the group.
+        '''
+        self.ausrs.extend(other.ausrs)
+        if other.best is not None and (self.best is None or other.best.ausr > self.best.ausr):
+            self.best = other.best
+
+    def to_dict(self):
+        '''
+        Get summary as JSON serialisable dict, see Result.to_dict.
+        '''
+        return {
+            'first': self.first.to_dict(),
+            'best': None if self.best is None else self.best.to_dict(),
+            'ausrs': [None if np.isnan(ausr) else ausr for ausr in self.ausrs],
+        }
+
+    @classmethod
+    def from_dict(cls, summary):
+        '''
+        Inverse of `to_dict`.
+        '''
+        return cls(
+            first=Result.from_dict(summary['first']),
+            best=None if summary['best'] is None else Result.from_dict(summary['best']),
+            ausrs=[np.nan if ausr is None else ausr for ausr in summary['ausrs']],
+        )
+
+class _ResultWriter:
+
+    '''
+    Write the best result of each bait group to a file in rankings_dir.
+
+    Only a summary of each unfinished bait group is kept in memory. A bait
+    group's file is written as soon as its last result is added.
+
+    Parameters
+    ----------
+    rankings_dir : ~pathlib.Path
+    combination_counts : ~typing.Mapping[str, int]
+        Number of results to expect per bait group id.
+    '''
+
+    def __init__(self, rankings_dir, combination_counts):
+        self._rankings_dir = rankings_dir
+        self._combination_counts = combination_counts
+        self._summaries = {}  # bait group id -> _GroupSummary, of unfinished groups
+        self._best_ausrs = {}  # bait group id -> best AUSR, of finished groups
+
+    def add(self, result):
+        '''
+        Add result, writing its bait group if this is its last result.
+
+        Parameters
+        ----------
+        result : morphbio.algorithm.Result
+        '''
+        group_id = result.bait_group_id
+        summary = self._summaries.setdefault(group_id, _GroupSummary(first=result))
+        summary.add(result)
+        if len(summary.ausrs) >= self._combination_counts.get(group_id, np.inf):
+            self._write(group_id)
+
+    def add_summary(self, group_id, summary):
+        '''
+        Add the results of a summary, e.g. of a shard.
+
+        Parameters
+        ----------
+        group_id : str
+        summary : _GroupSummary
+        '''
+        if group_id in self._summaries:
+            self._summaries[group_id].merge(summary)
+        else:
+            self._summaries[group_id] = summary
+        if len(self._summaries[group_id].ausrs) >= self._combination_counts.get(group_id, np.inf):
+            self._write(group_id)
+
+    def close(self):
+        '''
+        Write any remaining bait groups.
+
+        Returns
+        -------
+        ~pandas.Series
+            Best AUSR by bait group id, NaN if all its combinations were
+            skipped.
+        '''
+        for group_id in list(self._summaries):
+            self._write(group_id)
+        return pd.Series(self._best_ausrs, dtype=float)
+
+    def _write(self, group_id):
+        summary = self._summaries.pop(group_id)
+        output_file = self._rankings_dir / '{}.txt'.format(group_id)
+        if summary.best is None:
             # Note: All combinations were skipped, no results
-            best_result = group.iloc[0]
+            self._best_ausrs[group_id] = np.nan
             _write_result_txt(
                 output_file,
                 ausr='NA',
-                bait_group_name=best_result.bait_group_name,
+                p_value='NA',
+                bait_group_name=summary.first.bait_group_name,
                 matrix_name='NA',
                 clustering_name='NA',
-                present_baits=best_result.present_baits,
-                missing_baits=best_result.missing_baits,
+                present_baits=summary.first.present_baits,
+                missing_baits=summary.first.missing_baits,
                 ausr_stats='NA',
                 ranking='NA'
             )
         else:
-            best_result = group.iloc[best_index]
+            best_result = summary.best
+            self._best_ausrs[group_id] = best_result.ausr
             _write_result_txt(
                 output_file,
                 best_result.ausr,
+                'NA' if best_result.p_value is None else best_result.p_value,
                 best_result.bait_group_name,
                 best_result.matrix_name,
                 best_result.clustering_name,
                 best_result.present_baits,
                 best_result.missing_baits,
-                ausr_stats=group['ausr'].describe().to_string(),
+                ausr_stats=pd.Series(summary.ausrs).describe().to_string(),
                 ranking=best_result.ranking.to_string()
             )
         # TODO also write YAML
 
-    # Write overview of best AUSRs
-    overview_file = output_dir / 'overview.txt'
-    _logger.info('Writing overview of results to {}'.format(overview_file))
-    with overview_file.open('w') as f:
-        best_ausrs = results.groupby('bait_group_id')['ausr'].max()  #TODO this might filter out all NA groups
-        best_ausrs.sort_values(inplace=True, ascending=False)
-        f.write(dedent('''
-            Statistics of best AUSRs:
-            {}
-            
-            List of best AUSRs:
-            {}
-            ''').strip().format(
-                best_ausrs.describe().to_string(), # TODO consider how NA affects the stats
-                best_ausrs.to_string(header=False)
-            )
-        )
+class _ShardWriter(_ResultWriter):
+
+    '''
+    Write the summary of each bait group to a shard file instead.
+
+    The first line of the file is a JSON object with the ``shard`` as [index,
+    count]. Each other line is a JSON object with a ``bait_group_id`` and its
+    ``summary``, see _GroupSummary.to_dict.
+
+    Parameters
+    ----------
+    shard_file : ~pathlib.Path
+    shard : ~typing.Tuple[int, int]
+        Shard index and count.
+    combination_counts : ~typing.Mapping[str, int]
+        Number of results to expect per bait group id in this shard.
+    '''
+
+    def __init__(self, shard_file, shard, combination_counts):
+        super().__init__(None, combination_counts)
+        self._file = shard_file.open('w')
+        self._file.write(json.dumps({'shard': list(shard)}) + '\n')
+
+    def close(self):
+        best_ausrs = super().close()
+        self._file.close()
+        return best_ausrs
+
+    def _write(self, group_id):
+        summary = self._summaries.pop(group_id)
+        self._best_ausrs[group_id] = np.nan if summary.best is None else summary.best.ausr
+        self._file.write(json.dumps({'bait_group_id': group_id, 'summary': summary.to_dict()}) + '\n')
+
+def _read_shard(shard_file):
+    '''
+    Read shard file written by _ShardWriter.
+
+    Returns
+    -------
+    ~typing.Tuple[~typing.Tuple[int, int], ~typing.Iterable[~typing.Tuple[str, _GroupSummary]]]
+        Shard index and count, and summaries by bait group id.
+    '''
+    index, count = json.loads(shard_file.readline())['shard']
+    def summaries():
+        for line in shard_file:
+            entry = json.loads(line)
+            yield entry['bait_group_id'], _GroupSummary.from_dict(entry['summary'])
+    return (index, count), summaries()
 
-def _write_result_txt(output_file, ausr, bait_group_name, matrix_name, clustering_name, present_baits, missing_baits, ausr_stats, ranking):
+def _write_result_txt(output_file, ausr, p_value, bait_group_name, matrix_name, clustering_name, present_baits, missing_baits, ausr_stats, ranking):
     _logger.info('Writing result to {}'.format(output_file))
     present_baits = sorted(present_baits)
     missing_baits = sorted(missing_baits)
     with output_file.open('w') as f:
         f.write(dedent('''
             AUSR: {}
+            P-value: {}
             Bait group: {}
             Expression matrix used: {}
             Clustering used: {}
@@ -159,6 +649,7 @@ def _write_result_txt(output_file, ausr, bait_group_name, matrix_name, clusterin
             {}
             ''').strip().format(
                 ausr,
+                p_value,
                 bait_group_name,
                 matrix_name,
                 clustering_name,
@@ -0,0 +1,135 @@
+# Copyright (C) 2018 VIB/BEG/UGent - Tim Diels <timdiels.m@gmail.com>
+#
+# This file is part of MORPH.
+#
+# MORPH is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MORPH is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with MORPH.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Timing and memory instrumentation of MORPH runs
+'''
+
+from collections import Counter
+from contextlib import contextmanager
+import resource
+import sys
+import threading
+import time
+
+
+class Profiler:
+
+    '''
+    Collect time spent and memory growth per stage of a run, and counters.
+
+    Pass one to `morphbio.algorithm.morph` to profile a run. Stages are named
+    parts of the run, e.g. ``rank_genes``; each time a stage is entered counts
+    as a call.
+
+    Parameters
+    ----------
+    callback : ~typing.Callable[[str, float, int], None] or None
+        Called with stage name, seconds and peak RSS increase in bytes each
+        time a stage completes. With ``jobs > 1``, stages run in worker processes and are
+        reported, summed per stage, when a worker completes its task. Stages
+        of loading matrices may be reported from a background thread.
+    '''
+
+    def __init__(self, callback=None):
+        self._callback = callback
+        self._stages = {}  # name -> dict(calls, seconds, peak_rss_increase)
+        self._counters = Counter()
+        self._peak_rss = 0  # highest of this and merged processes
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()  # stages may run in multiple threads
+
+    @contextmanager
+    def stage(self, name):
+        '''
+        Context manager measuring a stage.
+
+        The memory of a stage is measured as the increase of the peak resident
+        set size (RSS) of the process while in the stage. A stage which stays
+        below the peak of earlier stages has an increase of 0; and while other
+        threads run stages, their increases overlap.
+        '''
+        start_rss = _get_peak_rss()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self._add_stage(name, 1, seconds, _get_peak_rss() - start_rss)
+
+    def count(self, name, amount=1):
+        '''
+        Increment a counter, e.g. the number of combinations ranked.
+        '''
+        with self._lock:
+            self._counters[name] += amount
+
+    def merge(self, profile):
+        '''
+        Add the stages and counters of another profile.
+
+        Parameters
+        ----------
+        profile : ~typing.Dict
+            Return of `to_dict` of another profiler, e.g. of a worker process.
+        '''
+        for name, stage in profile['stages'].items():
+            self._add_stage(name, stage['calls'], stage['seconds'], stage['peak_rss_increase'])
+        with self._lock:
+            self._counters.update(profile['counters'])
+            self._peak_rss = max(self._peak_rss, profile['peak_rss'])
+
+    def to_dict(self):
+        '''
+        Get profile as JSON serialisable dict.
+
+        Returns
+        -------
+        ~typing.Dict
+            ``stages`` maps each stage name to its number of ``calls``, total
+            ``seconds`` and ``peak_rss_increase`` (bytes, highest of its calls,
+            see `stage`). ``counters`` maps each counter to its count,
+            ``peak_rss`` is the peak RSS in bytes so far of the process,
+            or of merged processes if higher, and ``seconds`` is the time since
+            the profiler was created.
+        '''
+        peak_rss = _get_peak_rss()
+        with self._lock:
+            return {
+                'seconds': time.perf_counter() - self._start,
+                'peak_rss': max(self._peak_rss, peak_rss),
+                'stages': {name: dict(stage) for name, stage in self._stages.items()},
+                'counters': dict(self._counters),
+            }
+
+    def _add_stage(self, name, calls, seconds, peak_rss_increase):
+        with self._lock:
+            stage = self._stages.setdefault(name, {'calls': 0, 'seconds': 0.0, 'peak_rss_increase': 0})
+            stage['calls'] += calls
+            stage['seconds'] += seconds
+            stage['peak_rss_increase'] = max(stage['peak_rss_increase'], peak_rss_increase)
+        if self._callback:
+            self._callback(name, seconds, peak_rss_increase)
+
+def _get_peak_rss():
+    '''
+    Get peak resident set size of the current process so far, in bytes.
+    '''
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != 'darwin':
+        peak_rss *= 1024  # KiB on Linux and most other POSIX systems
+    return peak_rss
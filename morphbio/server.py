@@ -0,0 +1,193 @@
+# Copyright (C) 2018 VIB/BEG/UGent - Tim Diels <timdiels.m@gmail.com>
+#
+# This file is part of MORPH.
+#
+# MORPH is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MORPH is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with MORPH.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+HTTP server ranking ad-hoc bait groups with preloaded data
+'''
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from pathlib import Path
+from socketserver import ThreadingMixIn
+import json
+import logging
+
+from pytil import logging as logging_
+import click
+import yaml
+
+from morphbio import __version__
+from morphbio.algorithm import Ranker
+
+
+_logger = logging.getLogger(__name__)
+
+@click.command()
+@click.version_option(__version__)
+@click.option(
+    '--config', 'config_file',
+    required=True,
+    type=click.Path(exists=True, dir_okay=False, resolve_path=True),
+    help='Configuration YAML file, see config.yaml in the documentation.'
+)
+@click.option(
+    '--top-k',
+    show_default=True,
+    default=100,
+    type=click.IntRange(min=1),
+    help='Number of genes to return per ranking, unless a query specifies it.'
+)
+@click.option(
+    '--host',
+    show_default=True,
+    default='127.0.0.1',
+    help='Address to listen on.'
+)
+@click.option(
+    '--port',
+    show_default=True,
+    default=8000,
+    type=click.IntRange(min=0, max=65535),
+    help='Port to listen on.'
+)
+@click.option(
+    '--log', 'log_file',
+    show_default=True,
+    default='morph-server.log',
+    type=click.Path(dir_okay=False, resolve_path=True),
+    help='Log file.'
+)
+def main(config_file, top_k, host, port, log_file):
+    '''
+    Serve MORPH rankings of ad-hoc bait groups over HTTP.
+
+    All expression matrices and clusterings in the config are loaded once at
+    start up. For example:
+
+    \b
+        morph-server --config config.yaml --port 8000
+    '''
+    logging_.configure(Path(log_file))
+    with Path(config_file).open() as f:
+        config = yaml.load(f)
+    ranker = Ranker(config, top_k)
+    server = create_server(ranker, host, port)
+    _logger.info('Listening on {}:{}'.format(*server.server_address))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+def create_server(ranker, host='127.0.0.1', port=8000):
+    '''
+    Create HTTP server answering queries with a ranker.
+
+    Requests are handled concurrently, each in its own thread. Endpoints:
+
+    ``GET /``
+        Loaded species, matrices and clusterings, see Ranker.species.
+
+    ``POST /rank``
+        Rank a bait group. The body is a JSON object with ``species`` and
+        ``genes`` and optionally ``name`` and ``top_k``, see Ranker.rank. The
+        response is a JSON object with ``results``, each as in Result.to_dict,
+        and ``best``, the index of the result with the highest AUSR or
+        ``null`` if all were skipped.
+
+    Invalid requests get status 400 and a JSON object with an ``error``
+    message.
+
+    Parameters
+    ----------
+    ranker : morphbio.algorithm.Ranker
+    host : str
+    port : int
+        Port to listen on, 0 to pick a free port.
+
+    Returns
+    -------
+    ~http.server.HTTPServer
+        Server, not yet serving. Its address is ``server_address``.
+    '''
+    return _Server((host, port), ranker)
+
+class _Server(ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, address, ranker):
+        super().__init__(address, _RequestHandler)
+        self.ranker = ranker
+
+class _RequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path != '/':
+            self._send(404, {'error': 'Not found: {}'.format(self.path)})
+            return
+        self._send(200, {'species': self.server.ranker.species})
+
+    def do_POST(self):
+        if self.path != '/rank':
+            self._send(404, {'error': 'Not found: {}'.format(self.path)})
+            return
+        try:
+            query = self._read_query()
+            results = self.server.ranker.rank(
+                query['species'], query['genes'], query.get('name', 'query'),
+                query.get('top_k')
+            )
+        except ValueError as ex:
+            self._send(400, {'error': str(ex)})
+            return
+        ranked = [i for i, result in enumerate(results) if result.ausr is not None]
+        best = max(ranked, key=lambda i: results[i].ausr, default=None)
+        self._send(200, {
+            'results': [result.to_dict() for result in results],
+            'best': best,
+        })
+
+    def _read_query(self):
+        length = int(self.headers.get('Content-Length', 0))
+        query = json.loads(self.rfile.read(length).decode())
+        if not isinstance(query, dict):
+            raise ValueError('Query must be a JSON object')
+        for key in ('species', 'genes'):
+            if key not in query:
+                raise ValueError('Query is missing {!r}'.format(key))
+        if not isinstance(query['species'], str):
+            raise ValueError('species must be a string. Got: {!r}'.format(query['species']))
+        genes = query['genes']
+        if not isinstance(genes, list) or not all(isinstance(gene, str) for gene in genes):
+            raise ValueError('genes must be a list of gene names')
+        name = query.get('name', 'query')
+        if not isinstance(name, str):
+            raise ValueError('name must be a string. Got: {!r}'.format(name))
+        top_k = query.get('top_k')
+        if top_k is not None and (not isinstance(top_k, int) or isinstance(top_k, bool)):
+            raise ValueError('top_k must be an int >=1. Got: {!r}'.format(top_k))
+        return query
+
+    def _send(self, status, body):
+        body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        _logger.info('{} {}'.format(self.address_string(), format % args))
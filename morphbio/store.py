@@ -0,0 +1,126 @@
+# Copyright (C) 2018 VIB/BEG/UGent - Tim Diels <timdiels.m@gmail.com>
+#
+# This file is part of MORPH.
+#
+# MORPH is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MORPH is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with MORPH.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Content-addressed store of results, for incremental runs
+'''
+
+from pathlib import Path
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+import numpy as np
+
+from morphbio import cache
+
+
+_logger = logging.getLogger(__name__)
+
+class ResultStore:
+
+    '''
+    Results stored by a key derived from the content of their inputs.
+
+    Each entry is a JSON file at ``<directory>/<key[:2]>/<key>.json``. Entries
+    are written atomically, so concurrent runs may share a store.
+
+    Parameters
+    ----------
+    directory : ~pathlib.Path
+        Directory of the store, created if missing.
+    cache_dir : ~pathlib.Path or None
+        Cache directory to keep file hashes in across runs, see
+        morphbio.cache.load.
+    '''
+
+    def __init__(self, directory, cache_dir=None):
+        self._directory = Path(directory)
+        self._cache_dir = cache_dir
+        self._file_hashes = {}  # resolved path -> hex digest
+
+    def hash_file(self, path):
+        '''
+        Get SHA-1 hash of file content.
+
+        Parameters
+        ----------
+        path : str
+
+        Returns
+        -------
+        str
+            Hex digest.
+        '''
+        path = str(Path(path).resolve())
+        if path not in self._file_hashes:
+            arrays = cache.load(self._cache_dir, path, 'sha1', lambda: {'sha1': np.array(_hash_file(path))})
+            self._file_hashes[path] = str(arrays['sha1'])
+        return self._file_hashes[path]
+
+    def get(self, key):
+        '''
+        Get entry.
+
+        Parameters
+        ----------
+        key : str
+            Hex digest.
+
+        Returns
+        -------
+        ~typing.Dict or None
+            Entry, or `None` if not in store.
+        '''
+        try:
+            return json.loads(self._path(key).read_text())
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key, entry):
+        '''
+        Add or replace entry.
+
+        Parameters
+        ----------
+        key : str
+            Hex digest.
+        entry : ~typing.Dict
+            JSON serialisable entry.
+        '''
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=str(path.parent), prefix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, str(path))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def _path(self, key):
+        return self._directory / key[:2] / '{}.json'.format(key)
+
+def _hash_file(path):
+    hash_ = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(2**20), b''):
+            hash_.update(block)
+    return hash_.hexdigest()
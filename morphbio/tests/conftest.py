@@ -17,5 +17,17 @@
 
 from signal import signal, SIGPIPE, SIG_IGN
 
+import pytest
+
+from morphbio.tests.synthetic import generate
+
+
 # http://stackoverflow.com/a/30091579/1031434
 signal(SIGPIPE, SIG_IGN) # Ignore SIGPIPE
+
+@pytest.fixture
+def synthetic_config(tmpdir):
+    '''
+    Small synthetic config, see morphbio.tests.synthetic.
+    '''
+    return generate(tmpdir, genes=300, conditions=20, bait_groups=4, baits=20, top_k=20)
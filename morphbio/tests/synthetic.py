@@ -0,0 +1,127 @@
+# Copyright (C) 2018 VIB/BEG/UGent - Tim Diels <timdiels.m@gmail.com>
+#
+# This file is part of MORPH.
+#
+# MORPH is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MORPH is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with MORPH.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Synthetic input data for tests and benchmarks
+'''
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import yaml
+
+
+def generate(directory, genes, conditions=100, clusters=None, clusterings=2,
+             bait_groups=20, baits=30, top_k=100, seed=0):
+    '''
+    Write synthetic config.yaml, run_config.yaml and their data files.
+
+    Genes are generated in modules of co-expressed genes. Each clustering
+    recovers the modules with some genes moved to a random cluster and leaves
+    some genes unclustered. Each bait group is drawn mostly from a single
+    module, so AUSRs are realistic rather than 0.
+
+    Parameters
+    ----------
+    directory : ~pathlib.Path
+        Existing directory to write to.
+    genes : int
+        Number of genes (rows) in the expression matrix.
+    conditions : int
+        Number of conditions (columns) in the expression matrix.
+    clusters : int or None
+        Number of modules/clusters. Defaults to 1 per 100 genes.
+    clusterings : int
+        Number of clusterings of the matrix.
+    bait_groups : int
+        Number of bait groups.
+    baits : int
+        Number of baits per bait group.
+    top_k : int
+    seed : int
+        Seed of the random number generator.
+
+    Returns
+    -------
+    ~typing.Dict
+        Union of config.yaml and run_config.yaml, as passed to morph.
+    '''
+    directory = Path(directory)
+    rng = np.random.RandomState(seed)
+    clusters = clusters or max(1, genes // 100)
+    names = np.array(['gene{:05d}'.format(i) for i in range(genes)])
+    modules = rng.randint(clusters, size=genes)
+
+    # Expression matrix: module profile plus noise
+    profiles = rng.normal(size=(clusters, conditions))
+    matrix = pd.DataFrame(
+        profiles[modules] + rng.normal(scale=2, size=(genes, conditions)),
+        index=pd.Index(names, name='gene'),
+        columns=['condition{}'.format(i) for i in range(conditions)],
+    )
+    matrix_path = directory / 'matrix.txt'
+    matrix.to_csv(str(matrix_path), sep='\t', float_format='%.5g')
+
+    # Clusterings
+    clustering_paths = {}
+    for i in range(clusterings):
+        assignment = modules.copy()
+        moved = rng.rand(genes) < 0.2
+        assignment[moved] = rng.randint(clusters, size=moved.sum())
+        clustered = rng.rand(genes) < 0.9
+        path = directory / 'clustering{}.txt'.format(i)
+        pd.DataFrame({
+            'gene': names[clustered],
+            'cluster': ['cluster{}'.format(cluster) for cluster in assignment[clustered]],
+        }).to_csv(str(path), sep='\t', header=False, index=False)
+        clustering_paths['clustering{}'.format(i)] = str(path)
+
+    # Bait groups: mostly genes of 1 module, some random genes
+    groups = {}
+    for i in range(bait_groups):
+        module_genes = names[modules == rng.randint(clusters)]
+        from_module = min(len(module_genes), int(baits * 0.8))
+        group_genes = set(rng.choice(module_genes, from_module, replace=False))
+        group_genes.update(rng.choice(names, baits - from_module, replace=False))
+        groups['group{}'.format(i)] = {
+            'name': 'Group {}'.format(i),
+            'genes': [str(gene) for gene in sorted(group_genes)],
+        }
+
+    config = {
+        'species': {
+            'synthetic': {
+                'gene_pattern': 'gene[0-9]+',
+                'expression_matrices': {
+                    'matrix': {
+                        'path': str(matrix_path),
+                        'clusterings': clustering_paths,
+                    },
+                },
+            },
+        },
+    }
+    run_config = {
+        'top_k': top_k,
+        'bait_groups': {'synthetic': groups},
+    }
+    with (directory / 'config.yaml').open('w') as f:
+        yaml.safe_dump(config, f)
+    with (directory / 'run_config.yaml').open('w') as f:
+        yaml.safe_dump(run_config, f)
+    return dict(config, **run_config)
@@ -0,0 +1,478 @@
+# Copyright (C) 2018 VIB/BEG/UGent - Tim Diels <timdiels.m@gmail.com>
+#
+# This file is part of MORPH.
+#
+# MORPH is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MORPH is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with MORPH.  If not, see <http://www.gnu.org/licenses/>.
+
+from pathlib import Path
+import copy
+
+import numpy as np
+import pandas as pd
+import pytest
+import yaml
+
+from morphbio.algorithm import (
+    morph, plan, _BatchedCorrelations, _Clustering, _ClusteringStack,
+    _CorrelationCache, _GeneTable,
+    _StackRanking, _StandardisedMatrix, _get_ausrs, _get_entries, _standardise,
+    _chunk_by_cost, _get_gene_mapping, _standardise_file
+)
+from morphbio.profile import Profiler
+from morphbio.tests.synthetic import generate
+
+
+def reference_ranking(matrix, clustering, baits):
+    '''
+    Rank genes the brute-force way.
+
+    Each ranking, including each leave one out ranking, is built from scratch
+    from the correlations. NaN correlations (genes with constant expression)
+    count as 0.
+
+    Parameters
+    ----------
+    matrix : ~pandas.DataFrame
+        Expression matrix with genes as index.
+    clustering : ~typing.List[~typing.Tuple[str, str]]
+        (gene, cluster) of each entry of the clustering.
+    baits : ~typing.Collection[str]
+
+    Returns
+    -------
+    ~typing.Tuple[~typing.Dict[~typing.Tuple[str, str], float], ~typing.Dict[~typing.Tuple[str, str], float]]
+        Normalised score by (gene, cluster) of each ranked entry and 0-based
+        leave one out position by (bait, cluster), ``inf`` if not ranked.
+    '''
+    correlations = matrix.T.corr().fillna(0)
+    clustering = [(gene, cluster) for gene, cluster in clustering if gene in matrix.index]
+    baits = set(baits) & {gene for gene, _ in clustering}
+    clusters = sorted({cluster for _, cluster in clustering})
+
+    def rank(left_out=None):
+        scores = {}
+        for cluster in clusters:
+            genes = [gene for gene, cluster_ in clustering if cluster_ == cluster]
+            cluster_baits = [gene for gene in genes if gene in baits and (gene, cluster) != left_out]
+            if not cluster_baits:
+                continue
+            ranked = [gene for gene in genes if gene not in baits or (gene, cluster) == left_out]
+            if not ranked:
+                continue
+            pre_scores = np.array([correlations.loc[gene, cluster_baits].sum() for gene in ranked])
+            with np.errstate(divide='ignore', invalid='ignore'):
+                normalised = (pre_scores - pre_scores.mean()) / pre_scores.std()
+            scores.update({(gene, cluster): score for gene, score in zip(ranked, normalised)})
+        return scores
+
+    positions = {}
+    for bait, cluster in clustering:
+        if bait not in baits:
+            continue
+        scores = rank(left_out=(bait, cluster))
+        score = scores.pop((bait, cluster), np.nan)
+        if np.isnan(score):
+            positions[bait, cluster] = np.inf
+        else:
+            positions[bait, cluster] = sum(other > score for other in scores.values())
+    return rank(), positions
+
+def reference_ausr(positions):
+    positions = np.array(list(positions.values()))
+    return (1000 - positions[positions < 1000]).sum() / (1000 * len(positions))
+
+def write_input(directory, matrix, clustering, baits, **run_config):
+    '''
+    Write input files and get config of a single matrix, clustering and bait
+    group.
+    '''
+    directory = Path(str(directory))
+    matrix_path = directory / 'matrix.txt'
+    matrix.to_csv(str(matrix_path), sep='\t')
+    clustering_path = directory / 'clustering.txt'
+    with clustering_path.open('w') as f:
+        f.writelines('{}\t{}\n'.format(gene, cluster) for gene, cluster in clustering)
+    config = {
+        'species': {
+            'species': {
+                'gene_pattern': 'gene[0-9]+',
+                'expression_matrices': {
+                    'matrix': {
+                        'path': str(matrix_path),
+                        'clusterings': {'clustering': str(clustering_path)},
+                    },
+                },
+            },
+        },
+        'top_k': 1000,
+        'bait_groups': {'species': {'group': {'name': 'group', 'genes': sorted(baits)}}},
+    }
+    config.update(run_config)
+    return config
+
+def random_matrix(rng, genes, conditions=10):
+    names = ['gene{}'.format(i) for i in range(genes)]
+    return pd.DataFrame(rng.normal(size=(genes, conditions)), index=names)
+
+def random_clusterings(rng, genes, cluster_counts=(2, 4, 8)):
+    '''
+    Get clusterings with about 30% of genes in 2 clusters.
+
+    Returns
+    -------
+    ~typing.List[~typing.List[~typing.Tuple[str, str]]]
+        (gene, cluster) of each entry of each clustering.
+    '''
+    return [
+        [
+            (gene, 'cluster{}'.format(cluster))
+            for gene in genes
+            for cluster in rng.choice(cluster_count, 1 + (rng.rand() < 0.3), replace=False)
+        ]
+        for cluster_count in cluster_counts
+    ]
+
+def to_arrays(matrix, clusterings):
+    '''
+    Get matrix and clusterings as used by the algorithm.
+
+    Returns
+    -------
+    ~typing.Tuple[_GeneTable, _StandardisedMatrix, ~typing.List[_Clustering]]
+    '''
+    gene_table = _GeneTable()
+    standardised = _StandardisedMatrix(
+        gene_table.intern(matrix.index), _standardise(matrix.values, np.dtype(np.float64))
+    )
+    clusterings = [
+        _Clustering(
+            gene_table.intern([gene for gene, _ in clustering]),
+            np.unique([cluster for _, cluster in clustering], return_inverse=True)[1].astype(np.int32)
+        )
+        for clustering in clusterings
+    ]
+    return gene_table, standardised, clusterings
+
+@pytest.mark.parametrize('constant_gene', ['gene3', 'gene40'])  # bait, non-bait
+def test_constant_expression(tmpdir, constant_gene):
+    '''
+    A gene with constant expression has correlation 0 to all genes rather than
+    dropping its cluster from the ranking.
+    '''
+    rng = np.random.RandomState(0)
+    matrix = random_matrix(rng, 60)
+    matrix.loc[constant_gene] = 0
+    clustering = [('gene{}'.format(i), 'cluster{}'.format(i % 2)) for i in range(60)]
+    baits = ['gene{}'.format(i) for i in range(20)]
+    result, = morph(write_input(tmpdir, matrix, clustering, baits))
+
+    scores, positions = reference_ranking(matrix, clustering, baits)
+    expected = pd.Series(scores).sort_values(ascending=False)
+    assert len(result.ranking) == len(expected) == 40
+    assert list(result.ranking.index) == [gene for gene, _ in expected.index]
+    np.testing.assert_allclose(result.ranking.values, expected.values)
+    assert np.isfinite(list(positions.values())).all()
+    assert result.ausr == pytest.approx(reference_ausr(positions))
+
+@pytest.mark.parametrize('seed', range(5))
+def test_leave_one_out_positions(seed):
+    '''
+    Leave one out positions equal those of rebuilding the ranking without the
+    bait, with genes in multiple clusters and clusters with a single bait.
+    '''
+    rng = np.random.RandomState(seed)
+    matrix = random_matrix(rng, 40)
+    clusterings = random_clusterings(rng, matrix.index)
+    gene_table, standardised, clusterings_ = to_arrays(matrix, clusterings)
+    stack = _ClusteringStack(standardised, clusterings_)
+    baits = sorted(rng.choice(matrix.index, 8, replace=False))
+    bait_ids = gene_table.intern(baits)
+    ranking = _StackRanking(
+        standardised.correlate(bait_ids), standardised, bait_ids, stack,
+        np.ones(len(clusterings), dtype=bool)
+    )
+    for i, clustering in enumerate(clusterings):
+        _, expected = reference_ranking(matrix, clustering, baits)
+        positions = ranking.get_positions(i)
+        assert sorted(positions) == sorted(expected.values())
+        assert ranking.get_ausr(i) == pytest.approx(reference_ausr(expected))
+        assert ranking.get_max_ausr(i) >= ranking.get_ausr(i)
+
+    # The data covers the edge cases
+    assert np.isinf(ranking.get_positions(2)).any()  # single bait clusters
+    assert len(ranking.get_positions(2)) > len(baits)  # baits in multiple clusters
+
+@pytest.mark.parametrize('seed', range(5))
+def test_permutation_ausrs(seed):
+    '''
+    The AUSRs of a batch of bait sets equal those of ranking each bait set.
+    '''
+    rng = np.random.RandomState(seed)
+    matrix = random_matrix(rng, 60)
+    gene_table, standardised, clusterings = to_arrays(matrix, random_clusterings(rng, matrix.index))
+    single_bait_clusters = 0
+    for clustering in clusterings:
+        stack = _ClusteringStack(standardised, [clustering])
+        rows, codes = _get_entries(standardised, clustering)
+        bait_sets = np.array([
+            np.sort(rng.choice(standardised.genes, 8, replace=False))
+            for _ in range(40)
+        ])
+        expected = []
+        for baits in bait_sets:
+            ranking = _StackRanking(standardised.correlate(baits), standardised, baits, stack, np.ones(1, dtype=bool))
+            expected.append(ranking.get_ausr(0))
+            single_bait_clusters += np.isinf(ranking.get_positions(0)).any()
+        np.testing.assert_array_equal(_get_ausrs(standardised, rows, codes, bait_sets), expected)
+    assert single_bait_clusters
+
+def get_p_values(results):
+    return {
+        (result.bait_group_name, result.matrix_name, result.clustering_name): result.p_value
+        for result in results
+    }
+
+def test_p_value_jobs(synthetic_config):
+    '''
+    P-values do not depend on the number of jobs.
+    '''
+    config = dict(synthetic_config, permutations=20)
+    p_values = get_p_values(morph(config))
+    assert all(p_value is not None for p_value in p_values.values())
+    assert get_p_values(morph(config, jobs=2)) == p_values
+
+def test_p_value_rename(synthetic_config, tmpdir):
+    '''
+    Stored p-values of a renamed bait group equal those of a fresh run.
+    '''
+    config = dict(synthetic_config, permutations=20, result_store=str(tmpdir / 'store'))
+    list(morph(config))
+    groups = config['bait_groups']['synthetic']
+    config['bait_groups'] = {'synthetic': {
+        'renamed{}'.format(group_id): dict(group, name='Renamed {}'.format(group_id))
+        for group_id, group in groups.items()
+    }}
+    stored = get_p_values(morph(config))
+    del config['result_store']
+    assert stored == get_p_values(morph(config))
+
+def test_jobs(synthetic_config):
+    '''
+    Results do not depend on the number of jobs and with ordered=True are in
+    the order of jobs=1.
+    '''
+    # A second matrix, so workers switch between matrices
+    config = copy.deepcopy(synthetic_config)
+    matrices = config['species']['synthetic']['expression_matrices']
+    matrices['matrix2'] = dict(matrices['matrix'])
+    expected = [result.to_dict() for result in morph(config)]
+    assert len(expected) == 4 * 2 * 2  # bait groups * matrices * clusterings
+    assert [result.to_dict() for result in morph(config, jobs=2, ordered=True)] == expected
+    def key(result):
+        return result['bait_group_id'], result['matrix_name'], result['clustering_name']
+    results = [result.to_dict() for result in morph(config, jobs=2)]
+    assert sorted(results, key=key) == sorted(expected, key=key)
+
+def assert_results_close(results, expected, atol):
+    '''
+    Assert results are those of expected up to differences in rounding of
+    correlations.
+
+    Near-ties in the ranking may swap genes or change a leave one out position
+    by 1, so ranking scores are compared after sorting and AUSRs with a
+    tolerance of 1 position per bait.
+    '''
+    results = list(results)
+    assert len(results) == len(expected)
+    for result, expected_result in zip(results, expected):
+        assert result.clustering_name == expected_result.clustering_name
+        assert result.bait_group_id == expected_result.bait_group_id
+        assert list(result.present_baits) == list(expected_result.present_baits)
+        assert len(result.ranking) == len(expected_result.ranking)
+        np.testing.assert_allclose(result.ranking.values, expected_result.ranking.values, rtol=0, atol=atol)
+        assert result.ausr == pytest.approx(expected_result.ausr, abs=1e-3)
+
+def test_batched_correlations(synthetic_config):
+    '''
+    Batched correlations equal those of correlating each bait group.
+    '''
+    rng = np.random.RandomState(0)
+    matrix = random_matrix(rng, 60)
+    _, standardised, _ = to_arrays(matrix, [])
+    baits = np.sort(rng.choice(standardised.genes, 20, replace=False))
+    batched = _BatchedCorrelations(standardised, baits)
+    for _ in range(5):
+        subset = rng.choice(baits, 5, replace=False)
+        np.testing.assert_allclose(batched.get(subset), standardised.correlate(subset), rtol=0, atol=1e-12)
+
+    expected = list(morph(synthetic_config))
+    assert_results_close(morph(dict(synthetic_config, batch_correlations=True)), expected, atol=1e-10)
+
+def test_float32(synthetic_config):
+    '''
+    Results with float32 correlations are close to those with float64.
+    '''
+    expected = list(morph(synthetic_config))
+    assert_results_close(morph(dict(synthetic_config, correlation_dtype='float32')), expected, atol=1e-4)
+
+@pytest.mark.parametrize('block_size', [1, 7 * 10 * 8, 2**30])  # 1, 7 and all rows per block
+def test_standardise_file(tmpdir, block_size):
+    '''
+    Standardising a matrix file block by block equals standardising it whole.
+    '''
+    directory = Path(str(tmpdir))
+    matrix = random_matrix(np.random.RandomState(0), 30)
+    matrix.iloc[3] = 1  # constant row
+    path = directory / 'matrix.txt'
+    matrix.to_csv(str(path), sep='\t')
+    arrays = _standardise_file(str(path), np.dtype(np.float64), block_size, directory / 'blocks')
+    assert arrays['genes'].tolist() == list(matrix.index)
+    matrix = pd.read_csv(str(path), sep='\t', index_col=0)
+    expected = _standardise(matrix.values, np.dtype(np.float64))
+    np.testing.assert_allclose(np.load(str(arrays['values'])), expected, rtol=0, atol=1e-12)
+
+def test_matrix_block_size(tmpdir):
+    '''
+    Results with matrix_block_size are those without, with a matrix of several
+    blocks.
+    '''
+    # 2000 * 200 float64 values is 3 MiB, so 4 blocks of 1 MiB
+    config = generate(tmpdir, genes=2000, conditions=200, bait_groups=4, baits=20, top_k=20)
+    expected = list(morph(config))
+    config = dict(config, cache_dir=str(tmpdir / 'cache'), matrix_block_size=1)
+    for _ in range(2):  # cold and warm cache
+        assert_results_close(morph(config), expected, atol=1e-10)
+
+def test_best_only(tmpdir):
+    '''
+    With best_only, the best AUSR of each bait group is that of a full run,
+    while some combinations are abandoned.
+    '''
+    config = generate(tmpdir, genes=300, conditions=20, clusterings=6, bait_groups=4, baits=20, top_k=20)
+    def get_best(results):
+        best = {}
+        for result in results:
+            if result.ausr is not None:
+                best[result.bait_group_id] = max(best.get(result.bait_group_id, 0), result.ausr)
+        return best
+    expected = list(morph(config))
+    profiler = Profiler()
+    results = list(morph(config, profiler=profiler, best_only=True))
+    assert len(results) == len(expected)
+    assert get_best(results) == get_best(expected)
+    abandoned = [result for result in results if result.ausr is None]
+    assert len(abandoned) == profiler.to_dict()['counters']['abandoned_combinations'] > 0
+    assert all(result.skip_reason and result.ranking is None for result in abandoned)
+
+def test_chunk_by_cost():
+    '''
+    Chunks have similar cost and are returned most expensive first.
+    '''
+    seconds = {'a': 5, 'b': 4, 'c': 3, 'd': 3, 'e': 3}
+    bait_groups = {group_id: {'name': group_id} for group_id in seconds}
+    chunks = _chunk_by_cost(bait_groups, seconds, 2)
+    assert [sorted(chunk) for chunk in chunks] == [['b', 'c', 'e'], ['a', 'd']]
+    assert chunks[0]['b'] == {'name': 'b'}
+
+    # Random costs
+    rng = np.random.RandomState(0)
+    seconds = {'group{}'.format(i): cost for i, cost in enumerate(rng.exponential(size=50))}
+    bait_groups = {group_id: {} for group_id in seconds}
+    chunks = _chunk_by_cost(bait_groups, seconds, 4)
+    assert sorted(group_id for chunk in chunks for group_id in chunk) == sorted(seconds)
+    costs = [sum(seconds[group_id] for group_id in chunk) for chunk in chunks]
+    assert costs == sorted(costs, reverse=True)
+    assert costs[0] - costs[-1] <= max(seconds.values())
+
+    # No empty chunks
+    assert len(_chunk_by_cost({'a': {}}, {'a': 1}, 3)) == 1
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_plan(synthetic_config, jobs):
+    '''
+    A plan has an estimate of each combination.
+    '''
+    plan_ = plan(synthetic_config, jobs)
+    combinations = plan_.combinations[['bait_group_id', 'matrix_name', 'clustering_name']]
+    expected = [
+        (result.bait_group_id, result.matrix_name, result.clustering_name)
+        for result in morph(synthetic_config)
+    ]
+    assert sorted(map(tuple, combinations.values.tolist())) == sorted(expected)
+    groups = synthetic_config['bait_groups']['synthetic']
+    assert plan_.combinations['baits'].tolist() == [
+        len(groups[group_id]['genes']) for group_id in plan_.combinations['bait_group_id']
+    ]
+    assert (plan_.combinations['seconds'] > 0).all()
+    assert (plan_.combinations['memory'] > 0).all()
+    assert plan_.seconds >= plan_.combinations['seconds'].sum() / jobs  # plus loading matrices
+    assert plan_.memory > 0
+
+@pytest.mark.parametrize('cached', [False, True])
+def test_gene_mapping(tmpdir, cached):
+    '''
+    Genes map to their targets in the gene mapping, or else to themselves.
+    '''
+    gene_mapping = {
+        'loc2': ['os2'],
+        'loc3': ['os3a', 'os3b'],  # multiple targets
+        'loc5': ['os5', 'loc2'],  # target which is also a source
+        'loc7': [],
+    }
+    path = Path(str(tmpdir)) / 'gene_mapping.yaml'
+    with path.open('w') as f:
+        yaml.safe_dump(gene_mapping, f)
+    config = {'species': {'species': {'gene_pattern': '.*', 'gene_mapping': str(path)}}}
+    if cached:
+        config['cache_dir'] = str(tmpdir / 'cache')
+    genes = ['a', 'loc1', 'loc2', 'loc3', 'loc4', 'loc5', 'loc7', 'loc8', 'os2', 'zzz']  # 'zzz' sorts past the last source
+    rng = np.random.RandomState(0)
+    for _ in range(2):  # cold and warm cache
+        mapping = _get_gene_mapping(config, 'species')
+        assert mapping.map([]) == set()
+        for size in range(len(genes)):
+            for _ in range(10):
+                subset = rng.choice(genes, size, replace=False).tolist()
+                expected = {target for gene in subset for target in gene_mapping.get(gene, (gene,))}
+                assert mapping.map(subset) == expected
+    assert (tmpdir / 'cache').exists() == cached
+
+    # Without mapping, genes map to themselves
+    del config['species']['species']['gene_mapping']
+    assert _get_gene_mapping(config, 'species').map(genes) == set(genes)
+
+def test_correlation_cache():
+    '''
+    Cached correlations equal uncached correlations and the least recently
+    used baits are evicted first.
+    '''
+    rng = np.random.RandomState(0)
+    _, standardised, _ = to_arrays(random_matrix(rng, 60), [])
+    a, b, c, d, e, f, g, h = standardised.genes[:8]
+    correlation_cache = _CorrelationCache(standardised, max_size=3 * 60 * 8)  # 3 baits
+    def get(*baits):
+        baits = np.array(baits, dtype=np.int32)
+        np.testing.assert_allclose(correlation_cache.get(baits), standardised.correlate(baits), rtol=0, atol=1e-12)
+        return list(correlation_cache._correlations)
+    assert get(a, b) == [a, b]
+    assert get(c) == [a, b, c]
+    assert get(a) == [b, c, a]
+    assert get(d) == [c, a, d]
+    assert get(c, a) == [d, c, a]
+    assert get(e, f, g, h) == [f, g, h]  # more baits than fit
+    assert get() == [f, g, h]
+
+    # Without caching
+    correlation_cache = _CorrelationCache(standardised, max_size=0)
+    assert get(a, b) == []
@@ -0,0 +1,99 @@
+# Copyright (C) 2018 VIB/BEG/UGent - Tim Diels <timdiels.m@gmail.com>
+#
+# This file is part of MORPH.
+#
+# MORPH is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MORPH is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with MORPH.  If not, see <http://www.gnu.org/licenses/>.
+
+from pathlib import Path
+import os
+
+import numpy as np
+import pytest
+
+from morphbio import cache
+from morphbio.algorithm import morph
+
+
+@pytest.fixture
+def source(tmpdir):
+    path = Path(str(tmpdir)) / 'source.txt'
+    path.write_text('content')
+    return path
+
+def test_load(source, tmpdir):
+    '''
+    Arrays are created once and loaded from cache until the source's size or
+    modification time changes.
+    '''
+    cache_dir = Path(str(tmpdir)) / 'cache'
+    created = []
+    def load(variant='variant'):
+        def create():
+            created.append(variant)
+            return {'values': np.arange(len(created) * 3, dtype=np.int32)}
+        return cache.load(cache_dir, str(source), variant, create)
+
+    # Cold, then warm
+    arrays = load()
+    np.testing.assert_array_equal(arrays['values'], np.arange(3))
+    assert load()['values'].tolist() == [0, 1, 2]
+    assert created == ['variant']
+    with pytest.raises(ValueError):
+        load()['values'][0] = 1  # read-only
+
+    # Variants are cached separately
+    load('other')
+    load('other')
+    assert created == ['variant', 'other']
+
+    # Modification time changed
+    stat = source.stat()
+    os.utime(str(source), ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert len(load()['values']) == 9
+    assert created == ['variant', 'other', 'variant']
+
+    # Size changed, modification time kept
+    stat = source.stat()
+    source.write_text('changed content')
+    os.utime(str(source), ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert len(load()['values']) == 12
+    assert len(load()['values']) == 12
+    assert created == ['variant', 'other', 'variant', 'variant']
+
+def test_load_uncached(source):
+    '''
+    Without cache_dir, arrays are created on each load.
+    '''
+    created = []
+    def create():
+        created.append(None)
+        return {'values': np.arange(3)}
+    cache.load(None, str(source), 'variant', create)
+    cache.load(None, str(source), 'variant', create)
+    assert len(created) == 2
+
+def test_morph(synthetic_config, tmpdir):
+    '''
+    Results with a cold and with a warm cache_dir are those without cache.
+    '''
+    expected = [result.to_dict() for result in morph(synthetic_config)]
+    cache_dir = Path(str(tmpdir)) / 'cache'
+    config = dict(synthetic_config, cache_dir=str(cache_dir))
+    assert [result.to_dict() for result in morph(config)] == expected
+    def get_entries():
+        return {path: path.stat().st_mtime_ns for path in cache_dir.glob('*/meta.json')}
+    entries = get_entries()
+    assert entries
+    assert [result.to_dict() for result in morph(config)] == expected
+    assert get_entries() == entries  # not recreated
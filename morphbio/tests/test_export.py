@@ -0,0 +1,76 @@
+# Copyright (C) 2018 VIB/BEG/UGent - Tim Diels <timdiels.m@gmail.com>
+#
+# This file is part of MORPH.
+#
+# MORPH is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MORPH is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with MORPH.  If not, see <http://www.gnu.org/licenses/>.
+
+from pathlib import Path
+
+import pytest
+
+from morphbio.algorithm import morph
+from morphbio.export import ArrowWriter
+
+pa = pytest.importorskip('pyarrow')
+
+
+def read_arrow(path):
+    '''
+    Get record batches of an Arrow IPC file.
+    '''
+    reader = pa.ipc.open_file(pa.memory_map(str(path)))
+    return [reader.get_batch(i) for i in range(reader.num_record_batches)]
+
+def test_writer(synthetic_config, tmpdir):
+    '''
+    Written files contain the results, in multiple record batches.
+    '''
+    config = dict(synthetic_config)
+    config['bait_groups'] = {'synthetic': dict(
+        synthetic_config['bait_groups']['synthetic'],
+        missing={'name': 'Missing', 'genes': ['gene99999']},
+    )}
+    results = list(morph(config))
+    output_dir = Path(str(tmpdir))
+    writer = ArrowWriter(output_dir, batch_size=3)
+    for result in results:
+        writer.add(result)
+    writer.close()
+
+    # Results
+    batches = read_arrow(output_dir / 'results.arrow')
+    assert len(batches) == 4  # 10 results in batches of 3
+    table = pa.Table.from_batches(batches).to_pydict()
+    assert table['bait_group_id'] == [result.bait_group_id for result in results]
+    assert table['clustering_name'] == [result.clustering_name for result in results]
+    assert table['ausr'] == [result.ausr for result in results]
+    assert table['present_baits'] == [len(result.present_baits) for result in results]
+    skipped = [result.skip_reason is not None for result in results]
+    assert sum(skipped) == 2  # the missing group in each clustering
+    for is_skipped, ausr, skip_reason in zip(skipped, table['ausr'], table['skip_reason']):
+        assert (ausr is None) == is_skipped
+        assert (skip_reason is None) != is_skipped
+
+    # Rankings
+    batches = read_arrow(output_dir / 'rankings.arrow')
+    assert len(batches) > 1
+    table = pa.Table.from_batches(batches).to_pydict()
+    rows = list(zip(*(table[name] for name in ('bait_group_id', 'clustering_name', 'rank', 'gene', 'score'))))
+    expected = [
+        (result.bait_group_id, result.clustering_name, rank, gene, score)
+        for result in results if result.ranking is not None
+        for rank, (gene, score) in enumerate(result.ranking.items(), 1)
+    ]
+    assert rows == expected
+    assert min(table['rank']) == 1
@@ -0,0 +1,127 @@
+# Copyright (C) 2018 VIB/BEG/UGent - Tim Diels <timdiels.m@gmail.com>
+#
+# This file is part of MORPH.
+#
+# MORPH is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MORPH is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with MORPH.  If not, see <http://www.gnu.org/licenses/>.
+
+from pathlib import Path
+import json
+import shutil
+
+from click.testing import CliRunner
+import pandas as pd
+import pytest
+
+from morphbio.main import main
+
+
+@pytest.fixture
+def run(synthetic_config, tmpdir):
+    '''
+    Run the CLI with the synthetic config.yaml and run_config.yaml.
+    '''
+    directory = Path(str(tmpdir))
+    def run(output_dir, *args):
+        output_dir = directory / output_dir
+        output_dir.mkdir(exist_ok=True)
+        result = CliRunner().invoke(main, [
+            '--config', str(directory / 'config.yaml'),
+            '--run-config', str(directory / 'run_config.yaml'),
+            '--output', str(output_dir),
+        ] + list(args))
+        assert result.exit_code == 0, result.output
+        return output_dir
+    return run
+
+def read_output(output_dir):
+    '''
+    Get content of the rankings and overview.txt by path relative to
+    output_dir.
+    '''
+    paths = [output_dir / 'overview.txt'] + sorted((output_dir / 'rankings').iterdir())
+    return {str(path.relative_to(output_dir)): path.read_bytes() for path in paths}
+
+def test_shard_merge(run, tmpdir):
+    '''
+    Merged shards have the output of a run without shards.
+    '''
+    expected = read_output(run('plain'))
+    shard_files = [
+        str(run('shard{}'.format(index), '--shard', '{}/3'.format(index)) / 'shard.jsonl')
+        for index in (1, 2, 3)
+    ]
+    merged = Path(str(tmpdir)) / 'merged'
+    merged.mkdir()
+    result = CliRunner().invoke(main, ['merge', '--output', str(merged)] + shard_files[::-1])
+    assert result.exit_code == 0, result.output
+    assert read_output(merged) == expected
+
+def test_resume(run):
+    '''
+    Resuming a run killed while writing its journal has the output of a run
+    without interruption.
+    '''
+    expected_dir = run('plain')
+    expected = read_output(expected_dir)
+
+    # Keep the first half of the journal and part of the next entry
+    output_dir = run('resumed')
+    journal_file = output_dir / 'journal.jsonl'
+    lines = journal_file.read_text().splitlines(keepends=True)
+    assert len(lines) > 2
+    kept = lines[:len(lines) // 2]
+    journal_file.write_text(''.join(kept) + lines[len(kept)][:10])
+    shutil.rmtree(str(output_dir / 'rankings'))
+    (output_dir / 'overview.txt').unlink()
+
+    run('resumed', '--resume')
+    assert read_output(output_dir) == expected
+    def read_combinations(journal_file):
+        return sorted(
+            (entry['bait_group_id'], entry['matrix_name'], entry['clustering_name'])
+            for entry in map(json.loads, journal_file.read_text().splitlines())
+        )
+    assert read_combinations(journal_file) == read_combinations(expected_dir / 'journal.jsonl')
+
+def test_resume_arrow(run):
+    '''
+    On resume, the Arrow files are rewritten with the results of the journal
+    and of the resumed run.
+    '''
+    pa = pytest.importorskip('pyarrow')
+    def read_arrow(output_dir, name):
+        table = pa.ipc.open_file(pa.memory_map(str(output_dir / name))).read_all()
+        return sorted(zip(*table.to_pydict().values()))
+    expected_dir = run('plain', '--arrow')
+
+    output_dir = run('resumed', '--arrow')
+    journal_file = output_dir / 'journal.jsonl'
+    lines = journal_file.read_text().splitlines(keepends=True)
+    journal_file.write_text(''.join(lines[:len(lines) // 2]))
+    shutil.rmtree(str(output_dir / 'rankings'))
+
+    run('resumed', '--resume', '--arrow')
+    for name in ('results.arrow', 'rankings.arrow'):
+        assert read_arrow(output_dir, name) == read_arrow(expected_dir, name)
+    assert len(read_arrow(output_dir, 'results.arrow')) == len(lines)
+
+def test_plan(run):
+    '''
+    --plan writes plan.tsv without running.
+    '''
+    output_dir = run('plan', '--plan')
+    plan = pd.read_csv(str(output_dir / 'plan.tsv'), sep='\t')
+    assert list(plan.columns) == ['bait_group_id', 'matrix_name', 'clustering_name', 'baits', 'seconds', 'memory']
+    assert len(plan) == 4 * 2  # bait groups * clusterings
+    assert not (output_dir / 'journal.jsonl').exists()
@@ -0,0 +1,102 @@
+# Copyright (C) 2018 VIB/BEG/UGent - Tim Diels <timdiels.m@gmail.com>
+#
+# This file is part of MORPH.
+#
+# MORPH is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MORPH is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with MORPH.  If not, see <http://www.gnu.org/licenses/>.
+
+from pathlib import Path
+import json
+
+from click.testing import CliRunner
+import numpy as np
+
+from morphbio.main import main
+from morphbio.profile import Profiler, _get_peak_rss
+
+
+def test_stages():
+    '''
+    Calls and seconds of a stage accumulate, its peak RSS increase is the
+    highest of its calls.
+    '''
+    calls = []
+    profiler = Profiler(callback=lambda *call: calls.append(call))
+    with profiler.stage('small'):
+        pass
+    with profiler.stage('large'):
+        # Exceed the peak of earlier tests
+        array = np.ones(_get_peak_rss() + 2 ** 26, dtype=np.uint8)
+        del array
+    with profiler.stage('small'):
+        pass
+    profiler.count('things')
+    profiler.count('things', 2)
+    profile = profiler.to_dict()
+
+    assert [call[0] for call in calls] == ['small', 'large', 'small']
+    stages = profile['stages']
+    assert stages['small']['calls'] == 2
+    assert stages['small']['seconds'] == sum(call[1] for call in calls if call[0] == 'small')
+    assert stages['large']['calls'] == 1
+    assert stages['large']['peak_rss_increase'] >= 2 ** 26
+    assert stages['small']['peak_rss_increase'] < 2 ** 26
+    assert profile['peak_rss'] >= stages['large']['peak_rss_increase']
+    assert profile['counters'] == {'things': 3}
+    assert profile['seconds'] >= sum(stage['seconds'] for stage in stages.values())
+
+def test_merge():
+    '''
+    Merging adds calls, seconds and counters, and takes the highest peaks.
+    '''
+    worker = {
+        'seconds': 10.0,
+        'peak_rss': 2 ** 50,
+        'stages': {
+            'a': {'calls': 2, 'seconds': 3.0, 'peak_rss_increase': 5},
+            'b': {'calls': 1, 'seconds': 1.0, 'peak_rss_increase': 7},
+        },
+        'counters': {'things': 4},
+    }
+    calls = []
+    profiler = Profiler(callback=lambda *call: calls.append(call))
+    profiler.merge(worker)
+    profiler.merge(dict(worker, peak_rss=0, stages={'a': dict(worker['stages']['a'], peak_rss_increase=9)}))
+    profile = profiler.to_dict()
+
+    assert sorted(calls) == [('a', 3.0, 5), ('a', 3.0, 9), ('b', 1.0, 7)]
+    assert profile['stages'] == {
+        'a': {'calls': 4, 'seconds': 6.0, 'peak_rss_increase': 9},
+        'b': {'calls': 1, 'seconds': 1.0, 'peak_rss_increase': 7},
+    }
+    assert profile['counters'] == {'things': 8}
+    assert profile['peak_rss'] == 2 ** 50
+
+def test_profile_file(synthetic_config, tmpdir):
+    '''
+    The CLI writes the profile of the run to profile.json.
+    '''
+    directory = Path(str(tmpdir))
+    output_dir = directory / 'output'
+    output_dir.mkdir()
+    result = CliRunner().invoke(main, [
+        '--config', str(directory / 'config.yaml'),
+        '--run-config', str(directory / 'run_config.yaml'),
+        '--output', str(output_dir),
+    ])
+    assert result.exit_code == 0, result.output
+    with (output_dir / 'profile.json').open() as f:
+        profile = json.load(f)
+    assert {'load_matrix', 'correlate', 'rank_genes', 'write_output'} <= set(profile['stages'])
+    assert profile['counters']['combinations'] == 4 * 2  # bait groups * clusterings
+    assert profile['peak_rss'] > 0
@@ -0,0 +1,104 @@
+# Copyright (C) 2018 VIB/BEG/UGent - Tim Diels <timdiels.m@gmail.com>
+#
+# This file is part of MORPH.
+#
+# MORPH is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MORPH is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with MORPH.  If not, see <http://www.gnu.org/licenses/>.
+
+from http.client import HTTPConnection
+import json
+import threading
+
+import pytest
+
+from morphbio.algorithm import Ranker, morph
+from morphbio.server import create_server
+
+
+@pytest.fixture
+def ranker(synthetic_config):
+    return Ranker(synthetic_config, synthetic_config['top_k'])
+
+@pytest.fixture
+def request_(ranker):
+    '''
+    Send requests to a server of ranker.
+    '''
+    server = create_server(ranker, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    def request(method, path, body=None):
+        connection = HTTPConnection(*server.server_address)
+        try:
+            connection.request(method, path, None if body is None else json.dumps(body).encode())
+            response = connection.getresponse()
+            return response.status, json.loads(response.read().decode())
+        finally:
+            connection.close()
+    yield request
+    server.shutdown()
+    server.server_close()
+
+def test_species(request_):
+    status, body = request_('GET', '/')
+    assert status == 200
+    assert body == {'species': {'synthetic': {'matrix': ['clustering0', 'clustering1']}}}
+
+def test_rank(request_, synthetic_config):
+    '''
+    Results equal those of a morph run.
+    '''
+    group = synthetic_config['bait_groups']['synthetic']['group0']
+    status, body = request_('POST', '/rank', {'species': 'synthetic', 'genes': group['genes'], 'name': 'group0'})
+    assert status == 200
+    expected = [
+        result.to_dict() for result in morph(synthetic_config)
+        if result.bait_group_id == 'group0'
+    ]
+    for result in expected:
+        result['bait_group_name'] = 'group0'
+    assert body['results'] == json.loads(json.dumps(expected))
+    ausrs = [result['ausr'] for result in expected]
+    assert body['best'] == ausrs.index(max(ausrs))
+
+def test_unknown_genes(request_, ranker, synthetic_config):
+    '''
+    Genes unknown to the ranker are missing, not added to its gene table.
+    '''
+    genes = synthetic_config['bait_groups']['synthetic']['group0']['genes']
+    status, body = request_('POST', '/rank', {'species': 'synthetic', 'genes': genes + ['gene99999'], 'top_k': 5})
+    assert status == 200
+    for result in body['results']:
+        assert 'gene99999' in result['missing_baits']
+        assert len(result['ranking']) == 5
+    assert ranker._gene_table.lookup(['gene99999'])[0] == -1
+
+@pytest.mark.parametrize('query', [
+    [],
+    {'genes': []},
+    {'species': 'unknown', 'genes': []},
+    {'species': ['synthetic'], 'genes': []},
+    {'species': 'synthetic', 'genes': 'gene00001'},
+    {'species': 'synthetic', 'genes': [1]},
+    {'species': 'synthetic', 'genes': [], 'name': {}},
+    {'species': 'synthetic', 'genes': [], 'top_k': '5'},
+    {'species': 'synthetic', 'genes': [], 'top_k': 0},
+])
+def test_invalid_query(request_, query):
+    status, body = request_('POST', '/rank', query)
+    assert status == 400
+    assert body['error']
+
+def test_not_found(request_):
+    assert request_('GET', '/rank')[0] == 404
+    assert request_('POST', '/', {})[0] == 404
@@ -0,0 +1,114 @@
+# Copyright (C) 2018 VIB/BEG/UGent - Tim Diels <timdiels.m@gmail.com>
+#
+# This file is part of MORPH.
+#
+# MORPH is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MORPH is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with MORPH.  If not, see <http://www.gnu.org/licenses/>.
+
+from pathlib import Path
+
+from morphbio.algorithm import morph
+from morphbio.profile import Profiler
+from morphbio.store import ResultStore
+from morphbio.tests.synthetic import generate
+
+
+def run(config, **kwargs):
+    '''
+    Run morph.
+
+    Returns
+    -------
+    ~typing.Tuple[~typing.Dict, ~typing.Dict[str, int]]
+        Result dicts by combination and the counters of the run.
+    '''
+    profiler = Profiler()
+    results = {
+        (result.bait_group_id, result.matrix_name, result.clustering_name): result.to_dict()
+        for result in morph(config, profiler=profiler, **kwargs)
+    }
+    return results, profiler.to_dict()['counters']
+
+def test_store(tmpdir):
+    '''
+    Entries round trip, missing entries are None and file hashes follow file
+    content.
+    '''
+    directory = Path(str(tmpdir))
+    store = ResultStore(directory / 'store', directory / 'cache')
+    assert store.get('ab12') is None
+    store.put('ab12', {'ausr': 0.5})
+    assert store.get('ab12') == {'ausr': 0.5}
+    store.put('ab12', {'ausr': 0.25})
+    assert ResultStore(directory / 'store').get('ab12') == {'ausr': 0.25}
+
+    path = directory / 'file'
+    path.write_text('content')
+    hash_ = store.hash_file(str(path))
+    assert ResultStore(directory / 'store', directory / 'cache').hash_file(str(path)) == hash_
+    path.write_text('changed content')
+    assert ResultStore(directory / 'store', directory / 'cache').hash_file(str(path)) != hash_
+
+def test_reuse(synthetic_config, tmpdir):
+    '''
+    Results of unchanged combinations are reused, the others recomputed, with
+    the results of a run without store.
+    '''
+    config = dict(synthetic_config, result_store=str(tmpdir / 'store'))
+    expected, _ = run(synthetic_config)
+    results, counters = run(config)
+    assert results == expected
+    assert counters['combinations'] == 8
+    assert 'reused_combinations' not in counters
+
+    # Everything is reused
+    results, counters = run(config)
+    assert results == expected
+    assert counters['reused_combinations'] == 8
+    assert 'combinations' not in counters
+
+    # Move a gene to another cluster in clustering1
+    clustering_path = Path(config['species']['synthetic']['expression_matrices']['matrix']['clusterings']['clustering1'])
+    lines = clustering_path.read_text().splitlines(keepends=True)
+    gene, cluster = lines[0].split()
+    lines[0] = '{}\t{}\n'.format(gene, 'cluster0' if cluster != 'cluster0' else 'cluster1')
+    clustering_path.write_text(''.join(lines))
+    expected, _ = run(synthetic_config)
+    results, counters = run(config)
+    assert results == expected
+    assert counters['reused_combinations'] == 4
+    assert counters['combinations'] == 4
+
+    # Changing top_k affects all combinations, changing it back none
+    results, counters = run(dict(config, top_k=10))
+    assert results == run(dict(synthetic_config, top_k=10))[0]
+    assert 'reused_combinations' not in counters
+    _, counters = run(config)
+    assert counters['reused_combinations'] == 8
+
+def test_best_only(tmpdir):
+    '''
+    Results abandoned due to best_only are not stored.
+    '''
+    config = generate(tmpdir, genes=300, conditions=20, clusterings=6, bait_groups=4, baits=20, top_k=20)
+    config['result_store'] = str(tmpdir / 'store')
+    results, counters = run(config, best_only=True)
+    abandoned = {combination for combination, result in results.items() if result['skip_reason'] and result['present_baits']}
+    assert len(abandoned) == counters['abandoned_combinations'] > 0
+
+    # A full run computes only the abandoned combinations
+    expected, _ = run(dict(config, result_store=None))
+    results, counters = run(config)
+    assert results == expected
+    assert counters['combinations'] == len(abandoned)
+    assert counters['reused_combinations'] == len(results) - len(abandoned)
@@ -24,17 +24,22 @@ setup_args = dict(
         'pytil[logging,various]==7.*',
     ],
     extras_require={
+        'arrow': [
+            'pyarrow>=0.8',
+        ],
         'dev': [
             'sphinx==1.*',
             'sphinx-rtd-theme==0.*',
             'coverage-pth==0.*',
             'pytest==3.*',
+            'pytest-benchmark==3.*',
             'pytest-cov==2.*',
             'pytest-env==0.*',
         ],
     },
     entry_points={'console_scripts': [
-        'morph = morphbio.main:main'
+        'morph = morphbio.main:main',
+        'morph-server = morphbio.server:main',
     ]},
     # https://pypi.python.org/pypi?%3Aaction=list_classifiers
     classifiers=[